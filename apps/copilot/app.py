@@ -1,14 +1,19 @@
-from flask import Flask, request, jsonify, Response, stream_with_context
+import asyncio
+from quart import Quart, Response, request, jsonify
+from hypercorn.config import Config
+from hypercorn.asyncio import serve
 from pydantic import BaseModel, ValidationError, Field
 from typing import List, Optional
 from copilot import UserMessage, AssistantMessage, get_response
-from streaming import get_streaming_response
+from streaming import get_streaming_response, sse_response
 from lib import AgentContext, PromptContext, ToolContext, ChatContext
 import os
 from functools import wraps
-from copilot import copilot_instructions_edit_agent
+from copilot import copilot_instructions_edit_agent_version
 import json
-from audio_transcription import transcribe_audio
+from audio_transcription import join_segments, transcribe_audio, transcribe_audio_segments
+from client import PROVIDER_COPILOT_MODEL
+from response_cache import ResponseCache
 
 
 class DataSource(BaseModel):
@@ -30,13 +35,18 @@ class ApiRequest(BaseModel):
     current_workflow_config: str
     context: AgentContext | PromptContext | ToolContext | ChatContext | None = None
     dataSources: Optional[List[DataSource]] = None
+    # Identify the conversation, so later turns can carry only the changes to the workflow config
+    projectId: Optional[str] = None
+    conversationId: Optional[str] = None
 
 
 class ApiResponse(BaseModel):
     response: str
 
 
-app = Flask(__name__)
+app = Quart(__name__)
+
+edit_response_cache = ResponseCache()
 
 
 def validate_request(request_data: ApiRequest) -> None:
@@ -50,7 +60,7 @@ def validate_request(request_data: ApiRequest) -> None:
 
 def require_api_key(f):
     @wraps(f)
-    def decorated(*args, **kwargs):
+    async def decorated(*args, **kwargs):
         auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
             return jsonify({"error": "Missing or invalid authorization header"}), 401
@@ -60,48 +70,37 @@ def require_api_key(f):
         if actual and token != actual:
             return jsonify({"error": "Invalid API key"}), 403
 
-        return f(*args, **kwargs)
+        return await f(*args, **kwargs)
 
     return decorated
 
 
 @app.route("/health", methods=["GET"])
-def health():
+async def health():
     return jsonify({"status": "ok"})
 
 
 @app.route("/chat_stream", methods=["POST"])
 @require_api_key
-def chat_stream():
+async def chat_stream():
     try:
-        raw_data = request.json
+        raw_data = await request.get_json()
         print(f"Raw request JSON: {json.dumps(raw_data)}")
 
         request_data = ApiRequest(**raw_data)
         print(f"received /chat_stream request: {request_data}")
         validate_request(request_data)
 
-        def generate():
-            stream = get_streaming_response(
-                messages=request_data.messages,
-                workflow_schema=request_data.workflow_schema,
-                current_workflow_config=request_data.current_workflow_config,
-                context=request_data.context,
-                dataSources=request_data.dataSources,
-            )
-
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    yield f"data: {json.dumps({'content': content})}\n\n"
-
-            yield "event: done\ndata: {}\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            mimetype="text/event-stream",
-            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        stream = await get_streaming_response(
+            messages=request_data.messages,
+            workflow_schema=request_data.workflow_schema,
+            current_workflow_config=request_data.current_workflow_config,
+            context=request_data.context,
+            dataSources=request_data.dataSources,
+            projectId=request_data.projectId,
+            conversationId=request_data.conversationId,
         )
+        return sse_response(stream)
 
     except ValidationError as ve:
         print(ve)
@@ -116,23 +115,42 @@ def chat_stream():
 
 @app.route("/edit_agent_instructions", methods=["POST"])
 @require_api_key
-def edit_agent_instructions():
+async def edit_agent_instructions():
     try:
-        request_data = ApiRequest(**request.json)
+        request_data = ApiRequest(**(await request.get_json()))
         print(f"received /edit_agent_instructions request: {request_data}")
         validate_request(request_data)
 
-        response = get_response(
-            messages=request_data.messages,
-            workflow_schema=request_data.workflow_schema,
-            current_workflow_config=request_data.current_workflow_config,
-            context=request_data.context,
-            copilot_instructions=copilot_instructions_edit_agent,
+        # identical edit requests on the same workflow get the same (temperature 0) response
+        cache_key = ResponseCache.make_key(
+            copilot_instructions_edit_agent_version,
+            PROVIDER_COPILOT_MODEL,
+            request_data.workflow_schema,
+            request_data.current_workflow_config,
+            request_data.context.model_dump() if request_data.context else None,
+            [message.model_dump() for message in request_data.messages],
         )
+        bypass_cache = "no-cache" in request.headers.get("Cache-Control", "")
+        response = None if bypass_cache else edit_response_cache.get(cache_key)
+        cache_status = "BYPASS" if bypass_cache else ("HIT" if response is not None else "MISS")
+
+        if response is None:
+            response = await get_response(
+                messages=request_data.messages,
+                workflow_schema=request_data.workflow_schema,
+                current_workflow_config=request_data.current_workflow_config,
+                context=request_data.context,
+                projectId=request_data.projectId,
+                conversationId=request_data.conversationId,
+            )
+            edit_response_cache.set(cache_key, response)
 
         api_response = ApiResponse(response=response).model_dump()
-        print(f"sending /edit_agent_instructions response: {api_response}")
-        return jsonify(api_response)
+        print(
+            f"sending /edit_agent_instructions response (cache {cache_status}, {edit_response_cache.stats()}): "
+            f"{api_response}"
+        )
+        return jsonify(api_response), 200, {"X-Copilot-Cache": cache_status}
 
     except ValidationError as ve:
         print(ve)
@@ -146,18 +164,21 @@ def edit_agent_instructions():
 
 
 @app.route("/transcribe_audio", methods=["POST"])
-def transcribe_audio_route():
+async def transcribe_audio_route():
     try:
-        if "audio" not in request.files:
+        files = await request.files
+        if "audio" not in files:
             return jsonify({"error": "No audio file provided"}), 400
 
-        audio_file = request.files["audio"]
+        audio_file = files["audio"]
         audio_data = audio_file.read()
 
-        language = request.form.get("language", "ru")
+        form = await request.form
+        language = form.get("language", "ru")
+        chunked = form.get("chunked", "false").lower() == "true"
 
         # Транскрибируем аудио
-        transcription = transcribe_audio(audio_data, language)
+        transcription = await transcribe_audio(audio_data, language, chunked=chunked)
 
         if not transcription:
             return jsonify({"error": "Failed to transcribe audio"}), 500
@@ -169,6 +190,47 @@ def transcribe_audio_route():
         return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
 
+async def generate_transcription_sse(audio_data: bytes, language: str):
+    texts = []
+    try:
+        async for index, text in transcribe_audio_segments(audio_data, language):
+            texts.append(text)
+            yield f"data: {json.dumps({'index': index, 'text': text}, ensure_ascii=False)}\n\n"
+        transcription = join_segments(texts)
+        yield f"event: done\ndata: {json.dumps({'transcription': transcription}, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        print(e)
+        yield f"event: error\ndata: {json.dumps({'error': 'Failed to transcribe audio', 'details': str(e)})}\n\n"
+
+
+@app.route("/transcribe_audio_stream", methods=["POST"])
+async def transcribe_audio_stream_route():
+    """
+    Transcribes a long recording in segments and streams each segment's text as it becomes available, in order.
+    """
+    try:
+        files = await request.files
+        if "audio" not in files:
+            return jsonify({"error": "No audio file provided"}), 400
+
+        audio_data = files["audio"].read()
+        form = await request.form
+        language = form.get("language", "ru")
+    except Exception as e:
+        print(e)
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+    response = Response(
+        generate_transcription_sse(audio_data, language),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.timeout = None
+    return response
+
+
 if __name__ == "__main__":
-    print("Starting Flask server...")
-    app.run(port=3002, host="0.0.0.0", debug=True)
+    print("Starting async server...")
+    config = Config()
+    config.bind = ["0.0.0.0:3002"]
+    asyncio.run(serve(app, config))
@@ -1,11 +1,13 @@
+import asyncio
+import io
 import os
-import tempfile
-import subprocess
 import logging
-import uuid
 import sys
-from typing import Optional
-from openai import OpenAI
+import wave
+from typing import AsyncIterator, Optional, Tuple
+import numpy as np
+from openai import AsyncOpenAI
+from vad import trim_silence
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,84 +17,328 @@ logging.basicConfig(
 )
 logger = logging.getLogger("audio_transcription")
 
+TRANSCRIPTION_MODEL = "gpt-4o-mini-transcribe"
+SAMPLE_RATE = 16000  # Частота дискретизации 16кГц
 
-def transcribe_audio(audio_data: bytes, language: str = "ru") -> Optional[str]:
+# Максимальная длина сегмента и число одновременных запросов при транскрипции по частям
+TRANSCRIPTION_SEGMENT_SECONDS = float(os.getenv("TRANSCRIPTION_SEGMENT_SECONDS", "60"))
+TRANSCRIPTION_CONCURRENCY = int(os.getenv("TRANSCRIPTION_CONCURRENCY", "4"))
+SILENCE_FRAME_MS = 30
+
+# Обрезка тишины перед загрузкой (по умолчанию выключена: для принимаемых форматов она требует декодирования
+# ffmpeg и повторного сжатия); применяется, только если экономит хотя бы VAD_MIN_SAVED_SECONDS, иначе
+# загружается исходный файл
+TRANSCRIPTION_VAD = os.getenv("TRANSCRIPTION_VAD", "false").lower() == "true"
+VAD_MIN_SAVED_SECONDS = float(os.getenv("VAD_MIN_SAVED_SECONDS", "1"))
+
+# Основные бренды контейнера ISO BMFF (ftyp), которые API транскрипции принимает без конвертации
+MP4_BRANDS = {b"M4A ": "m4a", b"mp41": "mp4", b"mp42": "mp4", b"isom": "mp4"}
+
+# Общий клиент для всех запросов транскрипции (пул соединений переиспользуется)
+transcription_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def detect_audio_format(audio_data: bytes) -> Optional[str]:
+    """
+    Определяет по сигнатуре, принимает ли API транскрипции аудиоданные без конвертации.
+
+    Args:
+        audio_data: Бинарные данные аудиофайла
+
+    Returns:
+        Расширение файла для принимаемого формата или None, если нужна конвертация
+    """
+    header = audio_data[:64]
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:4] == b"\x1a\x45\xdf\xa3" and b"webm" in header:
+        return "webm"
+    if header[4:8] == b"ftyp" and header[8:12] in MP4_BRANDS:
+        return MP4_BRANDS[header[8:12]]
+    # Кадр MPEG audio: 11 бит синхронизации и ненулевой слой (у AAC/ADTS биты слоя равны нулю)
+    if header[:3] == b"ID3" or (
+        len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and (header[1] >> 1) & 3 != 0
+    ):
+        return "mp3"
+    return None
+
+
+async def run_ffmpeg(command: list[str], input_data: bytes) -> bytes:
+    """
+    Запускает ffmpeg, передавая данные через stdin/stdout без диска.
+    """
+    logger.debug(f"Команда ffmpeg: {' '.join(command)}")
+    process = await asyncio.create_subprocess_exec(
+        *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate(input_data)
+    if process.returncode != 0:
+        logger.error(f"STDERR: {stderr.decode('utf-8', errors='ignore')}")
+        raise RuntimeError(f"ffmpeg завершился с кодом {process.returncode}")
+    return stdout
+
+
+async def convert_to_pcm(audio_data: bytes) -> bytes:
+    """
+    Конвертирует аудио в 16-битный PCM 16кГц моно.
+    """
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-i",
+        "pipe:0",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-ac",
+        "1",  # Моно аудио
+        "-f",
+        "s16le",
+        "pipe:1",
+    ]
+    return await run_ffmpeg(command, audio_data)
+
+
+async def encode_opus(pcm: bytes) -> bytes:
+    """
+    Сжимает 16-битный PCM 16кГц моно в Ogg/Opus.
+    """
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-f",
+        "s16le",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-ac",
+        "1",
+        "-i",
+        "pipe:0",
+        "-c:a",
+        "libopus",
+        "-b:a",
+        "24k",
+        "-f",
+        "ogg",
+        "pipe:1",
+    ]
+    return await run_ffmpeg(command, pcm)
+
+
+def pcm_to_wav(pcm: bytes) -> bytes:
+    """
+    Упаковывает 16-битный PCM 16кГц моно в WAV в памяти.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+async def prepare_trimmed_upload(audio_data: bytes, audio_format: Optional[str], pcm: bytes) -> Tuple[str, bytes]:
+    """
+    Обрезает тишину в аудио и выбирает, что загрузить: исходный файл, если обрезка почти ничего не дает,
+    сжатую в Ogg/Opus обрезанную запись для сжатых форматов или WAV.
+    """
+    trimmed, stats = trim_silence(pcm)
+    upload = None
+    if audio_format and stats["seconds_saved"] < VAD_MIN_SAVED_SECONDS:
+        upload = (f"audio.{audio_format}", audio_data)
+    elif audio_format and audio_format != "wav":
+        try:
+            upload = ("audio.ogg", await encode_opus(trimmed))
+        except Exception as e:
+            logger.error(f"Не удалось сжать обрезанное аудио, загружаем исходный файл: {e}")
+            upload = (f"audio.{audio_format}", audio_data)
+    if upload is None:
+        upload = ("audio.wav", pcm_to_wav(trimmed))
+
+    # Без обрезки загрузили бы исходный файл принимаемого формата или WAV из полного PCM
+    baseline_bytes = len(audio_data) if audio_format else len(pcm_to_wav(pcm))
+    saved_seconds = stats["seconds_saved"] if upload[1] is not audio_data else 0.0
+    logger.info(
+        f"VAD: {stats['original_seconds']:.1f} с -> {stats['trimmed_seconds']:.1f} с речи; загружается {upload[0]}, "
+        f"сэкономлено {saved_seconds:.1f} с и {baseline_bytes - len(upload[1])} байт"
+    )
+    return upload
+
+
+def split_at_silence(pcm: bytes, max_segment_seconds: float = TRANSCRIPTION_SEGMENT_SECONDS) -> list[bytes]:
+    """
+    Делит 16-битный PCM 16кГц моно на сегменты не длиннее max_segment_seconds.
+
+    Каждый разрез делается в самом тихом кадре второй половины допустимого сегмента, чтобы не резать слова.
+
+    Args:
+        pcm: Аудио в формате 16-битный PCM 16кГц моно
+        max_segment_seconds: Максимальная длина сегмента в секундах
+
+    Returns:
+        Список сегментов PCM в исходном порядке
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    max_samples = int(max_segment_seconds * SAMPLE_RATE)
+    frame = SAMPLE_RATE * SILENCE_FRAME_MS // 1000
+    if len(samples) <= max_samples or max_samples < 2 * frame:
+        return [pcm]
+
+    segments = []
+    start = 0
+    while len(samples) - start > max_samples:
+        search_start = start + max_samples // 2
+        frames = (start + max_samples - search_start) // frame
+        window = samples[search_start : search_start + frames * frame].astype(np.float32).reshape(frames, frame)
+        energy = (window**2).mean(axis=1)
+        # Из одинаково тихих кадров берем последний, чтобы сегменты были длиннее
+        quietest = frames - 1 - int(np.argmin(energy[::-1]))
+        cut = search_start + quietest * frame + frame // 2
+        segments.append(samples[start:cut].tobytes())
+        start = cut
+    segments.append(samples[start:].tobytes())
+    return segments
+
+
+async def transcribe_upload(upload: Tuple[str, bytes], language: str) -> str:
+    logger.debug(f"Отправка запроса в OpenAI API с языком {language}, модель: {TRANSCRIPTION_MODEL}...")
+    transcript = await transcription_client.audio.transcriptions.create(
+        file=upload, language=language, model=TRANSCRIPTION_MODEL
+    )
+    return transcript.text
+
+
+async def transcribe_audio_segments(
+    audio_data: bytes,
+    language: str = "ru",
+    max_segment_seconds: float = TRANSCRIPTION_SEGMENT_SECONDS,
+    concurrency: int = TRANSCRIPTION_CONCURRENCY,
+) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Транскрибирует длинную запись по частям: аудио делится по паузам на сегменты, которые распознаются
+    параллельно (не более concurrency запросов одновременно).
+
+    Args:
+        audio_data: Бинарные данные аудиофайла
+        language: Код языка для распознавания
+        max_segment_seconds: Максимальная длина сегмента в секундах
+        concurrency: Максимальное число одновременных запросов к API
+
+    Yields:
+        Пары (номер сегмента, текст) в порядке сегментов, как только распознаны все предыдущие сегменты
+    """
+    pcm = await convert_to_pcm(audio_data)
+    if not pcm:
+        raise RuntimeError("Сконвертированное аудио имеет нулевой размер")
+    if TRANSCRIPTION_VAD:
+        trimmed, stats = trim_silence(pcm)
+        logger.info(
+            f"VAD: {stats['original_seconds']:.1f} с -> {stats['trimmed_seconds']:.1f} с речи, "
+            f"сэкономлено {stats['seconds_saved']:.1f} с и {stats['bytes_saved']} байт PCM"
+        )
+        pcm = trimmed
+    segments = split_at_silence(pcm, max_segment_seconds)
+    logger.info(f"Аудио длиной {len(pcm) / 2 / SAMPLE_RATE:.1f} с разделено на {len(segments)} сегментов")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def transcribe_segment(segment: bytes) -> str:
+        async with semaphore:
+            return await transcribe_upload(("audio.wav", pcm_to_wav(segment)), language)
+
+    tasks = [asyncio.create_task(transcribe_segment(segment)) for segment in segments]
+    try:
+        for index, task in enumerate(tasks):
+            yield index, (await task).strip()
+    finally:
+        # Если вызывающий прекратил чтение или произошла ошибка, отменяем оставшиеся запросы
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Забираем исключение упавших сегментов, чтобы asyncio не предупреждал о нем
+                task.exception()
+
+
+def join_segments(texts: list[str]) -> str:
+    return " ".join(text for text in texts if text)
+
+
+async def transcribe_audio(audio_data: bytes, language: str = "ru", chunked: bool = False) -> Optional[str]:
     """
     Преобразует аудиоданные в текст с использованием OpenAI API.
 
     Args:
         audio_data: Бинарные данные аудиофайла
         language: Код языка для распознавания (по умолчанию 'ru')
+        chunked: Распознавать длинные записи по частям параллельно (см. transcribe_audio_segments)
 
     Returns:
         Распознанный текст или None, если произошла ошибка
     """
-    input_filename = None
-    output_filename = None
-
     try:
         logger.info(f"Начало транскрипции аудио, размер данных: {len(audio_data)} байт, язык: {language}")
 
-        # Создаем временный файл для сохранения входных аудиоданных
-        input_filename = os.path.join(tempfile.gettempdir(), f"audio_input_{uuid.uuid4()}")
-        with open(input_filename, "wb") as f:
-            f.write(audio_data)
-        logger.debug(f"Входной файл создан: {input_filename}")
-
-        # Создаем временный файл для выходного WAV
-        output_filename = os.path.join(tempfile.gettempdir(), f"audio_output_{uuid.uuid4()}.wav")
-        logger.debug(f"Выходной файл будет: {output_filename}")
+        if chunked:
+            texts = [text async for _, text in transcribe_audio_segments(audio_data, language)]
+            text = join_segments(texts)
+            logger.info(f"Успешное распознавание текста: '{text}'")
+            return text
 
-        # Конвертируем аудио в WAV формат с помощью ffmpeg
-        try:
-            logger.debug("Запуск ffmpeg для конвертации аудио в WAV...")
-            command = [
-                "ffmpeg",
-                "-i",
-                input_filename,
-                "-ar",
-                "16000",  # Частота дискретизации 16кГц
-                "-ac",
-                "1",  # Моно аудио
-                "-y",  # Перезаписывать файл если существует
-                output_filename,
-            ]
-            logger.debug(f"Команда ffmpeg: {' '.join(command)}")
-
-            result = subprocess.run(command, check=True, capture_output=True)
-            logger.debug("Конвертация завершена успешно")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка при конвертации аудио: {e}")
-            logger.error(f"STDOUT: {e.stdout.decode('utf-8', errors='ignore')}")
-            logger.error(f"STDERR: {e.stderr.decode('utf-8', errors='ignore')}")
-            raise
-
-        # Проверяем, что файл существует и имеет корректный размер
-        if not os.path.exists(output_filename):
-            logger.error(f"Выходной файл не существует: {output_filename}")
-            return None
+        audio_format = detect_audio_format(audio_data)
+        if audio_format and not TRANSCRIPTION_VAD:
+            # Формат принимается API напрямую, конвертация не нужна
+            logger.debug(f"Формат {audio_format} принимается API, конвертация пропущена")
+            upload = (f"audio.{audio_format}", audio_data)
+        else:
+            # Конвертируем аудио в PCM с помощью ffmpeg
+            pcm = b""
+            try:
+                logger.debug("Запуск ffmpeg для конвертации аудио в PCM...")
+                pcm = await convert_to_pcm(audio_data)
+                logger.debug("Конвертация завершена успешно")
+            except Exception as e:
+                logger.error(f"Ошибка при конвертации аудио: {e}")
+                if not audio_format:
+                    raise
 
-        file_size = os.path.getsize(output_filename)
-        logger.debug(f"Размер сконвертированного WAV файла: {file_size} байт")
-        if file_size == 0:
-            logger.error("Сконвертированный WAV файл имеет нулевой размер")
-            return None
+            if pcm and TRANSCRIPTION_VAD:
+                upload = await prepare_trimmed_upload(audio_data, audio_format, pcm)
+            elif pcm:
+                upload = ("audio.wav", pcm_to_wav(pcm))
+            elif audio_format:
+                # Принимаемый формат можно загрузить и без обрезки тишины
+                upload = (f"audio.{audio_format}", audio_data)
+            else:
+                logger.error("Сконвертированное аудио имеет нулевой размер")
+                return None
+            logger.debug(f"Размер загружаемого аудио: {len(upload[1])} байт")
 
         # Используем OpenAI API для транскрипции
-        logger.debug("Начало транскрипции через OpenAI API...")
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
         try:
-            with open(output_filename, "rb") as audio_file:
-                logger.debug(f"Отправка запроса в OpenAI API с языком {language}...")
-                model = "gpt-4o-mini-transcribe"
-                logger.debug(f"Используемая модель: {model}")
+            text = await transcribe_upload(upload, language)
+            logger.info(f"Успешное распознавание текста: '{text}'")
+            return text
 
-                transcript = client.audio.transcriptions.create(file=audio_file, language=language, model=model)
+        except Exception as api_error:
+            logger.error(f"Ошибка при запросе к OpenAI API: {api_error}")
+            if upload[1] is not audio_data:
+                return None
 
-                text = transcript.text
-                logger.info(f"Успешное распознавание текста: '{text}'")
-                return text
+        # Исходный файл не принят API (формат определен неверно или поврежден): повторяем один раз через ffmpeg
+        logger.info("Повторная попытка транскрипции после конвертации в WAV")
+        pcm = await convert_to_pcm(audio_data)
+        if not pcm:
+            logger.error("Сконвертированное аудио имеет нулевой размер")
+            return None
+        try:
+            text = await transcribe_upload(("audio.wav", pcm_to_wav(pcm)), language)
+            logger.info(f"Успешное распознавание текста: '{text}'")
+            return text
 
         except Exception as api_error:
             logger.error(f"Ошибка при запросе к OpenAI API: {api_error}")
@@ -101,12 +347,3 @@ def transcribe_audio(audio_data: bytes, language: str = "ru") -> Optional[str]:
     except Exception as e:
         logger.error(f"Неожиданная ошибка при распознавании речи: {e}", exc_info=True)
         return None
-    finally:
-        # Убеждаемся, что временные файлы удалены
-        for filename in [input_filename, output_filename]:
-            if filename and os.path.exists(filename):
-                try:
-                    os.remove(filename)
-                    logger.debug(f"Удален временный файл: {filename}")
-                except Exception as cleanup_error:
-                    logger.error(f"Ошибка при удалении временного файла {filename}: {cleanup_error}")
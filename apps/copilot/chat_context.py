@@ -0,0 +1,123 @@
+import json
+import os
+from typing import Any, List, Optional
+
+from tokens import count_tokens, truncate_to_tokens
+
+# Token budget for the tested chat pasted into a copilot prompt, and for a single tool output within it
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "8000"))
+CHAT_CONTEXT_MAX_TOOL_OUTPUT_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOOL_OUTPUT_TOKENS", "400"))
+
+
+def is_transfer(name: Optional[str]) -> bool:
+    return bool(name) and name.startswith("transfer_to")
+
+
+def transfer_target(tool_call: dict) -> str:
+    function = tool_call.get("function") or {}
+    try:
+        return json.loads(function.get("arguments") or "{}")["assistant"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return function.get("name", "").removeprefix("transfer_to_")
+
+
+def elide(text: Any, max_tokens: int) -> str:
+    if not isinstance(text, str):
+        # Content can also be a list of parts or an object
+        text = json.dumps(text, ensure_ascii=False, default=str)
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    return f"{truncate_to_tokens(text, max_tokens)}... [{tokens - max_tokens} tokens elided]"
+
+
+def compact_message(message: Any, max_tool_output_tokens: int) -> Optional[dict]:
+    """
+    Reduces a chat message to the fields that matter for reviewing the chat.
+
+    Handoffs between agents become a single "transfer_to" entry and their tool results are dropped; other tool calls
+    keep their name and arguments, and long tool outputs are elided.
+    """
+    if not isinstance(message, dict):
+        return {"content": str(message)}
+
+    role = message.get("role")
+    if role == "tool" and is_transfer(message.get("tool_name")):
+        return None
+
+    compact = {"role": role}
+    if message.get("sender"):
+        compact["sender"] = message["sender"]
+
+    tool_calls = message.get("tool_calls") or []
+    transfers = [call for call in tool_calls if is_transfer((call.get("function") or {}).get("name"))]
+    other_calls = [call for call in tool_calls if call not in transfers]
+    if transfers and not other_calls and not message.get("content"):
+        compact["transfer_to"] = ", ".join(transfer_target(call) for call in transfers)
+        return compact
+
+    content = message.get("content")
+    if content:
+        compact["content"] = elide(content, max_tool_output_tokens) if role == "tool" else content
+    if role == "tool" and message.get("tool_name"):
+        compact["tool_name"] = message["tool_name"]
+    if other_calls:
+        functions = [call.get("function") or {} for call in other_calls]
+        compact["tool_calls"] = [{"name": f.get("name"), "arguments": f.get("arguments")} for f in functions]
+    return compact
+
+
+def compact_chat_context(
+    messages: List[Any],
+    token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+    max_tool_output_tokens: int = CHAT_CONTEXT_MAX_TOOL_OUTPUT_TOKENS,
+) -> str:
+    """
+    Renders a tested chat for a copilot prompt within a token budget.
+
+    Messages are compacted (see compact_message). The opening user message is kept, then the most recent messages
+    are kept while they fit in the budget; omitted messages in between are replaced by a note. If the last message
+    alone does not fit, its content is elided.
+
+    Args:
+        messages (List[Any]): The chat messages from a ChatContext.
+        token_budget (int): Maximum tokens of the rendered chat.
+        max_tool_output_tokens (int): Maximum tokens of a single tool output.
+
+    Returns:
+        str: The chat as JSON.
+    """
+    compacted = [compact for compact in (compact_message(m, max_tool_output_tokens) for m in messages) if compact]
+
+    # The opening user message usually states what was being tested, so it is kept ahead of the recent messages
+    head = []
+    if compacted and compacted[0].get("role") == "user":
+        head = [compacted.pop(0)]
+        if count_tokens(json.dumps(head[0], ensure_ascii=False)) > token_budget // 4:
+            head[0] = {**head[0], "content": elide(head[0].get("content") or "", max(token_budget // 4, 1))}
+
+    kept = []
+    used_tokens = count_tokens(json.dumps(head, ensure_ascii=False))
+    for compact in reversed(compacted):
+        rendered = json.dumps(compact, ensure_ascii=False)
+        tokens = count_tokens(rendered)
+        if used_tokens + tokens > token_budget:
+            if not kept and compact.get("content"):
+                # Elide the last message rather than sending no chat at all
+                compact = {**compact, "content": elide(compact["content"], max(token_budget // 2, 1))}
+                kept.append(compact)
+            break
+        kept.append(compact)
+        used_tokens += tokens
+    kept.reverse()
+
+    omitted = len(compacted) - len(kept)
+    if omitted:
+        kept.insert(0, {"note": f"{omitted} messages omitted here"})
+    kept = head + kept
+
+    rendered = json.dumps(kept, ensure_ascii=False)
+    print(
+        f"Compacted chat context: {len(messages)} messages -> {len(kept)} entries ({count_tokens(rendered)} tokens)"
+    )
+    return rendered
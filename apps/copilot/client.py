@@ -1,5 +1,5 @@
 import os
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import dotenv
 
 dotenv.load_dotenv()
@@ -28,3 +28,9 @@ if PROVIDER_BASE_URL:
 else:
     print(f"Using OpenAI directly for completions")
     completions_client = OpenAI(api_key=PROVIDER_API_KEY)
+
+async_completions_client = None
+if PROVIDER_BASE_URL:
+    async_completions_client = AsyncOpenAI(base_url=PROVIDER_BASE_URL, api_key=PROVIDER_API_KEY)
+else:
+    async_completions_client = AsyncOpenAI(api_key=PROVIDER_API_KEY)
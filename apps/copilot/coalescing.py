@@ -0,0 +1,75 @@
+import asyncio
+import os
+from typing import AsyncIterator
+
+# Buffered deltas are flushed after this many milliseconds or once they reach this many bytes; an interval of 0
+# sends every delta on its own
+SSE_FLUSH_INTERVAL_MS = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "50"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "1024"))
+
+
+async def coalesce_deltas(
+    deltas: AsyncIterator[str],
+    flush_interval_ms: float = SSE_FLUSH_INTERVAL_MS,
+    flush_bytes: int = SSE_FLUSH_BYTES,
+) -> AsyncIterator[str]:
+    """
+    Joins consecutive text deltas so a stream can be relayed in fewer, larger writes.
+
+    The first delta is passed through immediately. Later deltas are buffered and flushed once the oldest buffered
+    delta is `flush_interval_ms` old, even if no new delta arrives, or once the buffer reaches `flush_bytes`.
+
+    Args:
+        deltas (AsyncIterator[str]): The text deltas.
+        flush_interval_ms (float): Maximum time a delta is held back.
+        flush_bytes (int): Buffer size in bytes that triggers a flush.
+
+    Yields:
+        str: The joined deltas.
+    """
+    if flush_interval_ms <= 0:
+        async for delta in deltas:
+            yield delta
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = deltas.__aiter__()
+    next_delta = None
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    first = True
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer, buffered_bytes = [], 0
+                continue
+
+            completed, next_delta = next_delta, None
+            try:
+                delta = completed.result()
+            except StopAsyncIteration:
+                break
+
+            if first:
+                first = False
+                yield delta
+                continue
+            if not buffer:
+                deadline = loop.time() + flush_interval_ms / 1000
+            buffer.append(delta)
+            buffered_bytes += len(delta.encode("utf-8"))
+            if buffered_bytes >= flush_bytes:
+                yield "".join(buffer)
+                buffer, buffered_bytes = [], 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if next_delta is not None:
+            next_delta.cancel()
@@ -1,11 +1,11 @@
-from openai import OpenAI
-from flask import Flask, request, jsonify
 from pydantic import BaseModel, ValidationError, Field
 from typing import List, Dict, Any, Literal, Optional
-import json
 from lib import AgentContext, PromptContext, ToolContext, ChatContext
 from client import PROVIDER_COPILOT_MODEL
-from client import completions_client
+from client import async_completions_client
+from chat_context import compact_chat_context
+from prompts import compile_system_prompt, hash_text, log_prompt_usage
+from workflow_context import build_copilot_messages
 
 
 class UserMessage(BaseModel):
@@ -34,13 +34,17 @@ class DataSource(BaseModel):
 with open("copilot_edit_agent.md", "r", encoding="utf-8") as file:
     copilot_instructions_edit_agent = file.read()
 
+copilot_instructions_edit_agent_version = hash_text(copilot_instructions_edit_agent)
 
-def get_response(
+
+async def get_response(
     messages: List[UserMessage | AssistantMessage],
     workflow_schema: str,
     current_workflow_config: str,
     context: AgentContext | PromptContext | ToolContext | ChatContext | None = None,
     dataSources: Optional[List[DataSource]] = None,
+    projectId: Optional[str] = None,
+    conversationId: Optional[str] = None,
     copilot_instructions: str = copilot_instructions_edit_agent,
 ) -> str:
     # if context is provided, create a prompt for the context
@@ -65,44 +69,33 @@ def get_response(
                 context_prompt = f"""
 **NOTE**: The user has just tested the following chat using the workflow above and has provided feedback / question below this json dump:
 ```json
-{json.dumps(context.messages)}
+{compact_chat_context(context.messages)}
 ```
 """
     else:
         context_prompt = ""
 
-    # Add dataSources to the context if provided
-    data_sources_prompt = ""
-    if dataSources:
-        data_sources_prompt = f"""
-**NOTE**: The following data sources are available:
-```json
-{json.dumps([{"id": ds.id, "name": ds.name, "source_data": ds.model_dump()} for ds in dataSources])}
-```
-"""
-
     # add the workflow schema to the system prompt
-    sys_prompt = copilot_instructions.replace("{workflow_schema}", workflow_schema)
-
-    # add the current workflow config to the last user message
-    last_message = messages[-1]
-    last_message.content = f"""
-Context:
-The current workflow config is:
-```
-{current_workflow_config}
-```
-
-{context_prompt}
-{data_sources_prompt}
-
-User: {last_message.content}
-"""
-
-    updated_msgs = [{"role": "system", "content": sys_prompt}] + [message.model_dump() for message in messages]
+    if copilot_instructions is copilot_instructions_edit_agent:
+        instructions_version = copilot_instructions_edit_agent_version
+    else:
+        instructions_version = hash_text(copilot_instructions)
+    sys_prompt = compile_system_prompt("edit_agent", instructions_version, copilot_instructions, workflow_schema)
+
+    # add the current workflow config (or its changes since the last turn) to the user messages
+    updated_msgs = [{"role": "system", "content": sys_prompt}] + build_copilot_messages(
+        messages,
+        current_workflow_config,
+        context_prompt,
+        dataSources,
+        namespace="edit",
+        project_id=projectId,
+        conversation_id=conversationId,
+    )
 
-    response = completions_client.chat.completions.create(
+    response = await async_completions_client.chat.completions.create(
         model=PROVIDER_COPILOT_MODEL, messages=updated_msgs, temperature=0.0, response_format={"type": "json_object"}
     )
 
+    log_prompt_usage("edit_agent_instructions", response.usage)
     return response.choices[0].message.content
@@ -0,0 +1,140 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from tokens import count_tokens
+
+# Token budget for the instruction sections and examples selected per request; 0 sends all of them
+SECTION_TOKEN_BUDGET = int(os.getenv("COPILOT_SECTION_TOKEN_BUDGET", "4000"))
+
+# Instruction sections that are sent with every request, ahead of the selected ones
+CORE_SECTION_HEADINGS = ("## Overview", "## Section 1 :", "## Section 11:")
+
+# Examples also demonstrate the copilot_change output format, so at least this many are always selected
+MIN_EXAMPLES = 1
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def split_sections(text: str, heading_prefix: str):
+    """
+    Splits markdown into the text before the first heading and the sections starting with `heading_prefix`.
+
+    Headings inside fenced code blocks, such as those in example agent instructions, do not start a section.
+    """
+    preamble = []
+    sections = []
+    current = preamble
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        if line.startswith("```"):
+            in_fence = not in_fence
+        if not in_fence and line.startswith(heading_prefix):
+            current = [line]
+            sections.append(current)
+        else:
+            current.append(line)
+    return "".join(preamble), ["".join(section) for section in sections]
+
+
+class BM25Index:
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        self.idf = {
+            term: math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            for term in terms:
+                frequency = counts.get(term, 0)
+                if frequency:
+                    norm = self.k1 * (1 - self.b + self.b * length / self.average_length)
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+
+class SectionIndex:
+    """
+    Selects the instruction sections and examples relevant to a copilot request.
+
+    The core instruction sections are always included. The other sections and the examples are ranked with BM25
+    against the request and added, most relevant first, while they fit in the token budget. The result keeps the
+    order of the source files, so the core sections form a stable prompt prefix.
+    """
+
+    def __init__(self, instructions: str, examples: str):
+        _, instruction_sections = split_sections(instructions, "## ")
+        self.examples_preamble, example_sections = split_sections(examples, "### ")
+
+        self.core = [section for section in instruction_sections if section.startswith(CORE_SECTION_HEADINGS)]
+        self.sections = [
+            {"text": section, "is_example": False}
+            for section in instruction_sections
+            if not section.startswith(CORE_SECTION_HEADINGS)
+        ] + [{"text": section, "is_example": True} for section in example_sections]
+        for position, section in enumerate(self.sections):
+            section["position"] = position
+            section["tokens"] = count_tokens(section["text"])
+        self.index = BM25Index([section["text"] for section in self.sections])
+        self.total_tokens = count_tokens(instructions) + count_tokens(examples)
+
+    def select(self, query: str, token_budget: int = SECTION_TOKEN_BUDGET) -> Tuple[int, ...]:
+        """
+        Selects the instruction sections and examples for a request.
+
+        Args:
+            query (str): Text the sections are ranked against, such as the user's last message.
+            token_budget (int): Maximum tokens of selected sections and examples, on top of the core sections.
+
+        Returns:
+            Tuple[int, ...]: The positions of the selected sections, in source order; pass them to `render`. They
+                identify the selection, e.g. as the version of the compiled system prompt.
+        """
+        scores = self.index.scores(query)
+        # Without any lexical match, fall back to the order of the source files
+        ranked = sorted(self.sections, key=lambda section: (-scores[section["position"]], section["position"]))
+
+        selected = []
+        used_tokens = 0
+        for section in [s for s in ranked if s["is_example"]][:MIN_EXAMPLES]:
+            selected.append(section)
+            used_tokens += section["tokens"]
+        for section in ranked:
+            if section in selected or used_tokens + section["tokens"] > token_budget:
+                continue
+            selected.append(section)
+            used_tokens += section["tokens"]
+        selected.sort(key=lambda section: section["position"])
+
+        print(
+            f"Selected copilot sections: {[section['text'].splitlines()[0] for section in selected]} "
+            f"({used_tokens} of {self.total_tokens} instruction and example tokens, besides the core sections)"
+        )
+        return tuple(section["position"] for section in selected)
+
+    def render(self, positions: Tuple[int, ...]) -> str:
+        """
+        Returns the core sections followed by the sections and examples at `positions`.
+        """
+        selected = [self.sections[position] for position in positions]
+        instructions = [section["text"] for section in selected if not section["is_example"]]
+        examples = [section["text"] for section in selected if section["is_example"]]
+        parts = ["".join(self.core + instructions)]
+        if examples:
+            parts.append("".join([self.examples_preamble] + examples))
+        return "\n\n".join(parts)
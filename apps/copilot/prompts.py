@@ -0,0 +1,65 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any
+
+# Number of compiled system prompts kept, one per (template version, workflow schema, agent model). Each selection
+# of copilot instruction sections is its own template version, so this covers many selections per schema and model
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "256"))
+
+compiled_prompts = OrderedDict()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compile_system_prompt(
+    template_name: str, template_version: Any, template: str, workflow_schema: str, agent_model: str = ""
+) -> str:
+    """
+    Returns the system prompt for a template with the workflow schema and agent model filled in.
+
+    The templates keep their placeholders after the static instructions, so the compiled prompt starts with a
+    byte-stable prefix that the provider's prompt cache can reuse across schemas and models. Compiled prompts are
+    kept in an LRU keyed by template name and version, schema hash and model, so the template itself is not hashed
+    per request.
+
+    Args:
+        template_name (str): Name of the template.
+        template_version (Any): Hashable value that changes whenever the template does, computed once when the
+            template is loaded, e.g. its `hash_text`.
+        template (str): The template with `{workflow_schema}` and `{agent_model}` placeholders.
+        workflow_schema (str): The workflow JSON schema.
+        agent_model (str): The default model for new agents.
+
+    Returns:
+        str: The compiled system prompt.
+    """
+    key = (template_name, template_version, hash_text(workflow_schema), agent_model)
+    prompt = compiled_prompts.get(key)
+    if prompt is not None:
+        compiled_prompts.move_to_end(key)
+        return prompt
+
+    prompt = template.replace("{workflow_schema}", workflow_schema).replace("{agent_model}", agent_model)
+    compiled_prompts[key] = prompt
+    while len(compiled_prompts) > PROMPT_CACHE_SIZE:
+        compiled_prompts.popitem(last=False)
+    print(f"Compiled {template_name} system prompt for model {agent_model or '-'} ({len(prompt)} chars)")
+    return prompt
+
+
+def log_prompt_usage(endpoint: str, usage) -> None:
+    """
+    Logs the prompt tokens of a completion and how many of them were served from the provider's prompt cache.
+    """
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    print(
+        f"Copilot {endpoint} usage: {usage.prompt_tokens} prompt tokens ({cached_tokens} cached, "
+        f"{cached_tokens / usage.prompt_tokens if usage.prompt_tokens else 0:.0%}), "
+        f"{usage.completion_tokens} completion tokens"
+    )
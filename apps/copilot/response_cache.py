@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Seconds a cached copilot response stays valid, and the number of responses kept
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+
+class ResponseCache:
+    """
+    Content-addressed LRU cache of copilot responses with a time to live.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_size: int = RESPONSE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Hashes the JSON-serialisable parts of a request that determine its response.
+        """
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: str) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
@@ -1,11 +1,15 @@
-from openai import OpenAI
-from flask import Flask, request, jsonify, Response, stream_with_context
+from quart import Quart, request, jsonify, Response
 from pydantic import BaseModel, ValidationError, Field
 from typing import List, Dict, Any, Literal, Optional
 import json
 from lib import AgentContext, PromptContext, ToolContext, ChatContext
 from client import PROVIDER_COPILOT_MODEL, PROVIDER_DEFAULT_MODEL
-from client import completions_client
+from client import async_completions_client
+from chat_context import compact_chat_context
+from coalescing import coalesce_deltas
+from prompt_sections import SECTION_TOKEN_BUDGET, SectionIndex
+from prompts import compile_system_prompt, hash_text, log_prompt_usage
+from workflow_context import build_copilot_messages
 
 
 class UserMessage(BaseModel):
@@ -48,13 +52,21 @@ streaming_instructions = "\n\n".join(
     [copilot_instructions_multi_agent, copilot_multi_agent_example1, current_workflow_prompt]
 )
 
+# Index of the instruction sections and examples, to only send the ones relevant to a request
+section_index = SectionIndex(copilot_instructions_multi_agent, copilot_multi_agent_example1)
 
-def get_streaming_response(
+# Versions of the system prompt templates, for the compiled prompt cache; a section selection extends the version
+streaming_instructions_version = hash_text(streaming_instructions)
+
+
+async def get_streaming_response(
     messages: List[UserMessage | AssistantMessage],
     workflow_schema: str,
     current_workflow_config: str,
     context: AgentContext | PromptContext | ToolContext | ChatContext | None = None,
     dataSources: Optional[List[DataSource]] = None,
+    projectId: Optional[str] = None,
+    conversationId: Optional[str] = None,
 ) -> Any:
     # if context is provided, create a prompt for the context
     if context:
@@ -78,65 +90,97 @@ def get_streaming_response(
                 context_prompt = f"""
 **NOTE**: The user has just tested the following chat using the workflow above and has provided feedback / question below this json dump:
 ```json
-{json.dumps(context.messages)}
+{compact_chat_context(context.messages)}
 ```
 """
     else:
         context_prompt = ""
 
-    # Add dataSources to the context if provided
-    data_sources_prompt = ""
     if dataSources:
         print(f"Data sources found at project level: {dataSources}")
         print(f"Data source Names: {[ds.name for ds in dataSources]}")
-        data_sources_prompt = f"""
-**NOTE**: The following data sources are available:
-```json
-{json.dumps([{"id": ds.id, "name": ds.name, "source_data": ds.model_dump()} for ds in dataSources])}
-```
-"""
     else:
         print("No data sources found at project level")
 
-    # add the workflow schema to the system prompt
-    sys_prompt = streaming_instructions.replace("{workflow_schema}", workflow_schema)
+    # select the instruction sections and examples relevant to the user's request
+    if SECTION_TOKEN_BUDGET:
+        positions = section_index.select(messages[-1].content, SECTION_TOKEN_BUDGET)
+        template_version = (streaming_instructions_version, positions)
+        template = "\n\n".join([section_index.render(positions), current_workflow_prompt])
+    else:
+        template_version = streaming_instructions_version
+        template = streaming_instructions
 
-    # add the agent model to the system prompt
-    sys_prompt = sys_prompt.replace("{agent_model}", PROVIDER_DEFAULT_MODEL)
+    # add the workflow schema and the agent model to the system prompt
+    sys_prompt = compile_system_prompt(
+        "streaming", template_version, template, workflow_schema, PROVIDER_DEFAULT_MODEL
+    )
 
-    # add the current workflow config to the last user message
-    last_message = messages[-1]
-    last_message.content = f"""
-Context:
-The current workflow config is:
-```
-{current_workflow_config}
-```
+    # add the current workflow config (or its changes since the last turn) to the user messages
+    updated_msgs = [{"role": "system", "content": sys_prompt}] + build_copilot_messages(
+        messages,
+        current_workflow_config,
+        context_prompt,
+        dataSources,
+        namespace="chat",
+        project_id=projectId,
+        conversation_id=conversationId,
+    )
+    print(f"Input to copilot chat completions: {updated_msgs}")
+    return await async_completions_client.chat.completions.create(
+        model=PROVIDER_COPILOT_MODEL,
+        messages=updated_msgs,
+        temperature=0.0,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
 
-{context_prompt}
-{data_sources_prompt}
 
-User: {last_message.content}
-"""
+async def stream_content(stream):
+    async for chunk in stream:
+        if chunk.usage:
+            log_prompt_usage("chat_stream", chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
 
-    updated_msgs = [{"role": "system", "content": sys_prompt}] + [message.model_dump() for message in messages]
-    print(f"Input to copilot chat completions: {updated_msgs}")
-    return completions_client.chat.completions.create(
-        model=PROVIDER_COPILOT_MODEL, messages=updated_msgs, temperature=0.0, stream=True
+
+async def generate_sse(stream):
+    """
+    Relays a completions stream as SSE frames. Each frame is only produced once the previous one was sent,
+    and the upstream stream is closed when the client disconnects and the generator is cancelled.
+    Token deltas are coalesced into fewer frames, the first one being sent immediately.
+    """
+    try:
+        async for content in coalesce_deltas(stream_content(stream)):
+            yield f"data: {json.dumps({'content': content})}\n\n"
+
+        yield "event: done\ndata: {}\n\n"
+    finally:
+        await stream.close()
+
+
+def sse_response(stream) -> Response:
+    response = Response(
+        generate_sse(stream),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+    # Copilot responses can stream for longer than the default response timeout
+    response.timeout = None
+    return response
 
 
 def create_app():
-    app = Flask(__name__)
+    app = Quart(__name__)
 
     @app.route("/health", methods=["GET"])
-    def health():
+    async def health():
         return jsonify({"status": "ok"})
 
     @app.route("/chat_stream", methods=["POST"])
-    def chat_stream():
+    async def chat_stream():
         try:
-            request_data = request.json
+            request_data = await request.get_json()
             if not request_data or "messages" not in request_data:
                 return jsonify({"error": "No messages provided"}), 400
 
@@ -156,27 +200,14 @@ def create_app():
                 dataSources = [DataSource(**ds) for ds in request_data["dataSources"]]
                 print(f"Parsed dataSources: {dataSources}")
 
-            def generate():
-                stream = get_streaming_response(
-                    messages=messages,
-                    workflow_schema=workflow_schema,
-                    current_workflow_config=current_workflow_config,
-                    context=context,
-                    dataSources=dataSources,
-                )
-
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        yield f"data: {json.dumps({'content': content})}\n\n"
-
-                yield "event: done\ndata: {}\n\n"
-
-            return Response(
-                stream_with_context(generate()),
-                mimetype="text/event-stream",
-                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            stream = await get_streaming_response(
+                messages=messages,
+                workflow_schema=workflow_schema,
+                current_workflow_config=current_workflow_config,
+                context=context,
+                dataSources=dataSources,
             )
+            return sse_response(stream)
 
         except ValidationError as ve:
             return jsonify({"error": "Invalid request format", "details": str(ve)}), 400
@@ -188,5 +219,5 @@ def create_app():
 
 if __name__ == "__main__":
     app = create_app()
-    print("Starting Flask server...")
-    app.run(port=3002, host="0.0.0.0", debug=True)
+    print("Starting async server...")
+    app.run(port=3002, host="0.0.0.0")
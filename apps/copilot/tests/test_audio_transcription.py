@@ -0,0 +1,59 @@
+# tests/test_audio_transcription.py
+
+import asyncio
+
+import audio_transcription
+from audio_transcription import detect_audio_format
+
+
+def test_detect_audio_format_containers():
+    assert detect_audio_format(b"RIFF\x24\x00\x00\x00WAVEfmt ") == "wav"
+    assert detect_audio_format(b"OggS\x00\x02" + b"\x00" * 20) == "ogg"
+    assert detect_audio_format(b"fLaC\x00\x00\x00\x22") == "flac"
+    assert detect_audio_format(b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01webm") == "webm"
+
+
+def test_detect_audio_format_mp3():
+    assert detect_audio_format(b"ID3\x04\x00\x00\x00\x00\x00\x00") == "mp3"
+    # MPEG-1 Layer III
+    assert detect_audio_format(b"\xff\xfb\x90\x64") == "mp3"
+
+
+def test_detect_audio_format_rejects_adts():
+    # AAC/ADTS shares the frame sync with MP3 but has zero layer bits
+    assert detect_audio_format(b"\xff\xf1\x50\x80\x02\x1f\xfc") is None
+    assert detect_audio_format(b"\xff\xf9\x50\x80\x02\x1f\xfc") is None
+
+
+def test_detect_audio_format_mp4_brands():
+    assert detect_audio_format(b"\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00") == "m4a"
+    assert detect_audio_format(b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00") == "mp4"
+    assert detect_audio_format(b"\x00\x00\x00\x20ftypmp42\x00\x00\x00\x00") == "mp4"
+    assert detect_audio_format(b"\x00\x00\x00\x18ftyp3gp4\x00\x00\x00\x00") is None
+
+
+def test_detect_audio_format_unknown():
+    assert detect_audio_format(b"") is None
+    assert detect_audio_format(b"not audio at all") is None
+
+
+def test_transcribe_audio_retries_rejected_passthrough(monkeypatch):
+    uploads = []
+
+    async def fake_transcribe_upload(upload, language):
+        uploads.append(upload[0])
+        if upload[0] != "audio.wav":
+            raise RuntimeError("Invalid file format")
+        return "привет"
+
+    async def fake_convert_to_pcm(audio_data):
+        return b"\x00\x00" * 160
+
+    monkeypatch.setattr(audio_transcription, "TRANSCRIPTION_VAD", False)
+    monkeypatch.setattr(audio_transcription, "transcribe_upload", fake_transcribe_upload)
+    monkeypatch.setattr(audio_transcription, "convert_to_pcm", fake_convert_to_pcm)
+
+    text = asyncio.run(audio_transcription.transcribe_audio(b"ID3\x04\x00\x00\x00\x00\x00\x00"))
+
+    assert text == "привет"
+    assert uploads == ["audio.mp3", "audio.wav"]
@@ -0,0 +1,30 @@
+from functools import lru_cache
+
+import tiktoken
+
+# The agents service has the same helpers in src/graph/helpers/rag_packing.py. They are not shared because the two
+# services are separate deployables, each with its own requirements and Docker image.
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The BPE file is fetched on first use; fall back to an estimate when it is unavailable
+        print(f"Could not load tiktoken encoding, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[: max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
@@ -0,0 +1,87 @@
+import os
+from typing import Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+
+# A frame is speech when its energy is this many dB above the recording's noise floor (and above VAD_MIN_DB)
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "12"))
+VAD_MIN_DB = float(os.getenv("VAD_MIN_DB", "-55"))
+# Speech regions are widened by this much so word onsets and endings are not clipped
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "240"))
+# Pauses longer than VAD_MAX_PAUSE_MS are shortened to VAD_KEEP_PAUSE_MS
+VAD_MAX_PAUSE_MS = int(os.getenv("VAD_MAX_PAUSE_MS", "700"))
+VAD_KEEP_PAUSE_MS = int(os.getenv("VAD_KEEP_PAUSE_MS", "400"))
+
+
+def detect_speech_frames(samples: np.ndarray, frame: int) -> np.ndarray:
+    """
+    Marks the frames of a mono signal that contain speech, from their energy relative to the noise floor.
+    """
+    frames = len(samples) // frame
+    energy = (samples[: frames * frame].astype(np.float32) / 32768).reshape(frames, frame) ** 2
+    energy_db = 10 * np.log10(energy.mean(axis=1) + 1e-10)
+    noise_floor = np.percentile(energy_db, 10)
+    speech = energy_db > max(noise_floor + VAD_THRESHOLD_DB, VAD_MIN_DB)
+
+    padding = VAD_PADDING_MS // FRAME_MS
+    if padding and speech.any():
+        speech = np.convolve(speech, np.ones(2 * padding + 1), mode="same") > 0
+    return speech
+
+
+def trim_silence(pcm: bytes) -> Tuple[bytes, dict]:
+    """
+    Removes leading and trailing silence from 16-bit 16 kHz mono PCM and shortens long pauses.
+
+    Args:
+        pcm (bytes): The audio as 16-bit 16 kHz mono PCM.
+
+    Returns:
+        Tuple[bytes, dict]: The trimmed PCM, and stats with the original and trimmed duration and the seconds and
+        bytes saved. Audio without detected speech is returned unchanged.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    original_seconds = len(samples) / SAMPLE_RATE
+    unchanged = {
+        "original_seconds": original_seconds,
+        "trimmed_seconds": original_seconds,
+        "seconds_saved": 0.0,
+        "bytes_saved": 0,
+    }
+    if len(samples) < frame:
+        return pcm, unchanged
+
+    speech = detect_speech_frames(samples, frame)
+    if not speech.any():
+        return pcm, unchanged
+
+    voiced = np.flatnonzero(speech)
+    keep = np.zeros(len(speech), dtype=bool)
+    keep[voiced[0] : voiced[-1] + 1] = True
+
+    # Shorten pauses between speech regions, keeping half of the retained pause on each side
+    max_pause = VAD_MAX_PAUSE_MS // FRAME_MS
+    keep_pause = VAD_KEEP_PAUSE_MS // FRAME_MS
+    gaps = np.flatnonzero(np.diff(voiced) > max_pause + 1)
+    for gap in gaps:
+        pause_start = voiced[gap] + 1 + keep_pause // 2
+        pause_end = voiced[gap + 1] - (keep_pause - keep_pause // 2)
+        keep[pause_start:pause_end] = False
+
+    frames = samples[: len(speech) * frame].reshape(len(speech), frame)
+    trimmed = frames[keep].reshape(-1)
+    if keep[-1]:
+        trimmed = np.concatenate([trimmed, samples[len(speech) * frame :]])
+
+    trimmed_pcm = trimmed.tobytes()
+    trimmed_seconds = len(trimmed) / SAMPLE_RATE
+    return trimmed_pcm, {
+        "original_seconds": original_seconds,
+        "trimmed_seconds": trimmed_seconds,
+        "seconds_saved": original_seconds - trimmed_seconds,
+        "bytes_saved": len(pcm) - len(trimmed_pcm),
+    }
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from tokens import count_tokens
+
+# Number of conversations whose sent workflow context is remembered
+WORKFLOW_CONTEXT_CACHE_SIZE = int(os.getenv("WORKFLOW_CONTEXT_CACHE_SIZE", "1000"))
+
+# Conversation key -> user turns as they were sent to the model. Each turn records the raw user content, the
+# workflow and data source parts of its context, the content that was sent, and the workflow config and data
+# sources the model has seen as of that turn.
+conversation_turns = OrderedDict()
+
+MISSING = object()
+
+
+def conversation_key(namespace: str, project_id: str, conversation_id: str) -> str:
+    # Scoped to the project, so a conversation id can never reach the state of another project's conversation
+    return hashlib.sha256(f"{namespace}\n{project_id}\n{conversation_id}".encode("utf-8")).hexdigest()
+
+
+def is_named_list(value: Any) -> bool:
+    """
+    True for lists of dicts with unique "name" keys, such as the agents, prompts and tools of a workflow.
+    """
+    if not isinstance(value, list):
+        return False
+    names = [item.get("name") for item in value if isinstance(item, dict)]
+    return len(names) == len(value) and None not in names and len(set(names)) == len(names)
+
+
+def diff_named_items(old: list, new: list) -> dict:
+    old_by_name = {item["name"]: item for item in old}
+    new_names = {item["name"] for item in new}
+
+    diff = {}
+    added = [item for item in new if item["name"] not in old_by_name]
+    removed = [name for name in old_by_name if name not in new_names]
+    changed = []
+    for item in new:
+        previous = old_by_name.get(item["name"])
+        if previous is None or previous == item:
+            continue
+        entry = {"name": item["name"]}
+        fields = {key: value for key, value in item.items() if previous.get(key, MISSING) != value}
+        if fields:
+            entry["set"] = fields
+        unset = [key for key in previous if key not in item]
+        if unset:
+            entry["unset"] = unset
+        changed.append(entry)
+
+    if added:
+        diff["added"] = added
+    if removed:
+        diff["removed"] = removed
+    if changed:
+        diff["changed"] = changed
+    return diff
+
+
+def diff_workflow_configs(old: dict, new: dict) -> dict:
+    """
+    Computes a structural diff between two workflow configs.
+
+    Lists of named items (agents, prompts, tools, ...) are compared by name, and only the fields that differ are
+    included for changed items. Other top-level fields are replaced or removed as a whole.
+
+    Args:
+        old (dict): The config previously sent to the model.
+        new (dict): The current config.
+
+    Returns:
+        dict: A diff with optional "set", "unset" and "items" keys; empty when the configs are equal.
+    """
+    diff = {}
+    for key, value in new.items():
+        previous = old.get(key, MISSING)
+        if previous == value:
+            continue
+        if previous is not MISSING and is_named_list(previous) and is_named_list(value):
+            diff.setdefault("items", {})[key] = diff_named_items(previous, value)
+        else:
+            diff.setdefault("set", {})[key] = value
+    unset = [key for key in old if key not in new]
+    if unset:
+        diff["unset"] = unset
+    return diff
+
+
+def full_config_prompt(current_workflow_config: str) -> str:
+    return f"""The current workflow config is:
+```
+{current_workflow_config}
+```"""
+
+
+def config_diff_prompt(diff: dict) -> str:
+    return f"""The workflow config has changed since the last config shown in this conversation. To get the current \
+config, apply these changes to it: "set" replaces top-level fields, "unset" removes them, and "items" lists the \
+agents, prompts, tools etc. that were added, removed (by name) or changed (only the differing fields are listed):
+```json
+{json.dumps(diff, ensure_ascii=False)}
+```"""
+
+
+UNCHANGED_CONFIG_PROMPT = "The workflow config is unchanged since the last config shown in this conversation."
+
+SUPERSEDED_CONFIG_PROMPT = "The workflow config at this point is omitted; a later message shows the current config."
+
+UNCHANGED_DATA_SOURCES_PROMPT = """
+**NOTE**: The available data sources are unchanged since they were last listed in this conversation.
+"""
+
+REMOVED_DATA_SOURCES_PROMPT = """
+**NOTE**: All data sources listed earlier in this conversation have been removed; no data sources are available.
+"""
+
+
+def data_sources_prompt(data_sources_json: str) -> str:
+    return f"""
+**NOTE**: The following data sources are available:
+```json
+{data_sources_json}
+```
+"""
+
+
+def render_user_turn(workflow_prompt: str, context: str, sources_prompt: str, user: str) -> str:
+    return f"""
+Context:
+{workflow_prompt}
+
+{context}
+{sources_prompt}
+
+User: {user}
+"""
+
+
+def build_workflow_prompt(previous_config: Optional[dict], current_workflow_config: str, turn: int):
+    """
+    Returns the workflow part of the context for a user turn, the config the model knows after it, and whether
+    the part is the full config.
+    """
+    full_prompt = full_config_prompt(current_workflow_config)
+    try:
+        config = json.loads(current_workflow_config)
+    except (json.JSONDecodeError, TypeError):
+        config = None
+    if not isinstance(config, dict):
+        print(f"Workflow context for user turn {turn}: sent full config, it is not a JSON object")
+        return full_prompt, None, True
+
+    full_tokens = count_tokens(full_prompt)
+    if previous_config is None:
+        print(f"Workflow context for user turn {turn}: sent full config ({full_tokens} tokens)")
+        return full_prompt, config, True
+
+    diff = diff_workflow_configs(previous_config, config)
+    prompt = config_diff_prompt(diff) if diff else UNCHANGED_CONFIG_PROMPT
+    tokens = count_tokens(prompt)
+    if tokens >= full_tokens:
+        print(
+            f"Workflow context for user turn {turn}: sent full config ({full_tokens} tokens), "
+            f"diff was {tokens} tokens"
+        )
+        return full_prompt, config, True
+
+    print(
+        f"Workflow context for user turn {turn}: sent {'diff' if diff else 'unchanged note'} ({tokens} tokens) "
+        f"instead of full config ({full_tokens} tokens)"
+    )
+    return prompt, config, False
+
+
+def build_copilot_messages(
+    messages: List[Any],
+    current_workflow_config: str,
+    context_prompt: str = "",
+    data_sources: Optional[list] = None,
+    namespace: str = "chat",
+    project_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+) -> List[dict]:
+    """
+    Builds the chat messages for a copilot request, adding the workflow context to the user messages.
+
+    The full workflow config is sent once per conversation; later user turns only carry a diff against the config
+    the model has already seen, and data sources are only listed again when they change. Earlier user turns are
+    resent exactly as they were sent before, except when the full config has to be sent again (the diff would be
+    larger): then the configs and diffs of the earlier turns are left out, so the prompt carries one full config.
+    Conversations are identified by the project and a conversation id
+    chosen by the client; without them, or when the earlier turns of a conversation are not known (for example
+    after a restart), the full config is sent with the last message.
+
+    Args:
+        messages (List[UserMessage | AssistantMessage]): The conversation, ending with a user message.
+        current_workflow_config (str): The current workflow config as JSON.
+        context_prompt (str): Context for the last message only, such as the agent the user is working on.
+        data_sources (list): Optional data sources of the project.
+        namespace (str): Separates conversations of different copilot endpoints.
+        project_id (str): The project the conversation belongs to.
+        conversation_id (str): Identifies the conversation within the project.
+
+    Returns:
+        List[dict]: The messages to send, without the system prompt.
+    """
+    user_indices = [i for i, message in enumerate(messages) if message.role == "user"]
+    if not user_indices:
+        return [message.model_dump() for message in messages]
+    key = conversation_key(namespace, project_id, conversation_id) if project_id and conversation_id else None
+    prior_users = [messages[i].content for i in user_indices[:-1]]
+
+    turns = conversation_turns.get(key, []) if key else []
+    if len(turns) >= len(prior_users) and all(turn["user"] == user for turn, user in zip(turns, prior_users)):
+        turns = turns[: len(prior_users)]
+    else:
+        turns = [
+            {"user": user, "workflow": None, "sources": "", "content": user, "config": None, "data_sources": None}
+            for user in prior_users
+        ]
+    previous = turns[-1] if turns else {"config": None, "data_sources": None}
+
+    turn = len(turns) + 1
+    workflow_prompt, config, full = build_workflow_prompt(previous["config"], current_workflow_config, turn)
+    if full:
+        # Restart the diff chain: earlier configs and diffs are superseded by the full config of this turn
+        turns = [
+            {
+                **earlier,
+                "workflow": SUPERSEDED_CONFIG_PROMPT,
+                "content": render_user_turn(SUPERSEDED_CONFIG_PROMPT, "", earlier["sources"], earlier["user"]),
+            }
+            if earlier["workflow"] not in (None, SUPERSEDED_CONFIG_PROMPT)
+            else earlier
+            for earlier in turns
+        ]
+
+    data_sources_json = None
+    sources_prompt = ""
+    if data_sources:
+        data_sources_json = json.dumps(
+            [{"id": ds.id, "name": ds.name, "source_data": ds.model_dump()} for ds in data_sources]
+        )
+        if data_sources_json == previous["data_sources"]:
+            sources_prompt = UNCHANGED_DATA_SOURCES_PROMPT
+        else:
+            sources_prompt = data_sources_prompt(data_sources_json)
+            print(f"Workflow context for user turn {turn}: sent data sources ({count_tokens(sources_prompt)} tokens)")
+    elif previous["data_sources"]:
+        # The model was shown data sources earlier in the conversation
+        sources_prompt = REMOVED_DATA_SOURCES_PROMPT
+
+    last_user = messages[user_indices[-1]].content
+
+    # The context prompt only applies to the current turn, so it is left out of the stored history
+    turns.append(
+        {
+            "user": last_user,
+            "workflow": workflow_prompt,
+            "sources": sources_prompt,
+            "content": render_user_turn(workflow_prompt, "", sources_prompt, last_user),
+            "config": config,
+            "data_sources": data_sources_json,
+        }
+    )
+    if key:
+        conversation_turns[key] = turns
+        conversation_turns.move_to_end(key)
+        while len(conversation_turns) > WORKFLOW_CONTEXT_CACHE_SIZE:
+            conversation_turns.popitem(last=False)
+
+    updated_msgs = []
+    user_turn = 0
+    for index, message in enumerate(messages):
+        if message.role != "user":
+            updated_msgs.append(message.model_dump())
+        elif index == user_indices[-1]:
+            content = render_user_turn(workflow_prompt, context_prompt, sources_prompt, last_user)
+            updated_msgs.append({"role": "user", "content": content})
+        else:
+            updated_msgs.append({"role": "user", "content": turns[user_turn]["content"]})
+            user_turn += 1
+    return updated_msgs
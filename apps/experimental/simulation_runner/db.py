@@ -1,9 +1,11 @@
-from pymongo import MongoClient
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReplaceOne, ReturnDocument, UpdateOne
 from bson import ObjectId
 import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from scenario_types import TestRun, TestScenario, TestSimulation, TestResult, AggregateResults
+from scenario_types import TestRun, TestScenario, TestSimulation, TestSimulationJob, TestResult, AggregateResults
 
 MONGO_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017/rowboat").strip()
 
@@ -11,12 +13,23 @@ TEST_SCENARIOS_COLLECTION = "test_scenarios"
 TEST_SIMULATIONS_COLLECTION = "test_simulations"
 TEST_RUNS_COLLECTION = "test_runs"
 TEST_RESULTS_COLLECTION = "test_results"
+TEST_SIMULATION_JOBS_COLLECTION = "test_simulation_jobs"
 API_KEYS_COLLECTION = "api_keys"
 
+# Finished jobs are completed in batches, once this many are pending or the oldest has waited this many seconds
+RESULT_BATCH_SIZE = int(os.environ.get("RESULT_BATCH_SIZE", "20"))
+RESULT_FLUSH_SECONDS = float(os.environ.get("RESULT_FLUSH_SECONDS", "2"))
+
+
+# One pooled client shared by all helpers, created on first use inside the service's event loop
+mongo_client: Optional[AsyncIOMotorClient] = None
+
 
 def get_db():
-    client = MongoClient(MONGO_URI)
-    return client["rowboat"]
+    global mongo_client
+    if mongo_client is None:
+        mongo_client = AsyncIOMotorClient(MONGO_URI)
+    return mongo_client["rowboat"]
 
 
 def get_collection(collection_name: str):
@@ -24,12 +37,31 @@ def get_collection(collection_name: str):
     return db[collection_name]
 
 
-def get_api_key(project_id: str):
+async def ensure_indexes():
+    """
+    Creates the indexes used by the runner's queries, if they do not exist yet.
+    """
+    collection = get_collection(TEST_RUNS_COLLECTION)
+    await collection.create_index([("status", ASCENDING), ("lastHeartbeat", ASCENDING)])
+    await get_collection(TEST_RESULTS_COLLECTION).create_index([("runId", ASCENDING), ("simulationId", ASCENDING)])
+    jobs = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    await jobs.create_index([("runId", ASCENDING), ("simulationId", ASCENDING)], unique=True)
+    await jobs.create_index([("status", ASCENDING), ("leaseExpiresAt", ASCENDING)])
+
+
+def close_db():
+    global mongo_client
+    if mongo_client is not None:
+        mongo_client.close()
+        mongo_client = None
+
+
+async def get_api_key(project_id: str):
     """
     If you still use an API key pattern, adapt as needed.
     """
     collection = get_collection(API_KEYS_COLLECTION)
-    doc = collection.find_one({"projectId": project_id})
+    doc = await collection.find_one({"projectId": project_id})
     if doc:
         return doc["key"]
     else:
@@ -41,35 +73,74 @@ def get_api_key(project_id: str):
 #
 
 
-def get_pending_run() -> Optional[TestRun]:
+async def get_pending_run(worker_id: str) -> Optional[TestRun]:
     """
-    Finds a run with 'pending' status, marks it 'running', and returns it.
+    Finds a run with 'pending' status, marks it 'running' under a lease held by `worker_id`, and returns it.
+    The lease is kept alive by `update_run_heartbeat` and counts as one attempt at the run.
     """
     collection = get_collection(TEST_RUNS_COLLECTION)
-    doc = collection.find_one_and_update({"status": "pending"}, {"$set": {"status": "running"}}, return_document=True)
-    if doc:
-        return TestRun(
-            id=str(doc["_id"]),
-            projectId=doc["projectId"],
-            name=doc["name"],
-            simulationIds=doc["simulationIds"],
-            workflowId=doc["workflowId"],
-            status="running",
-            startedAt=doc["startedAt"],
-            completedAt=doc.get("completedAt"),
-            aggregateResults=doc.get("aggregateResults"),
-            lastHeartbeat=doc.get("lastHeartbeat"),
-        )
-    return None
+    doc = await collection.find_one_and_update(
+        {"status": "pending"},
+        {
+            "$set": {"status": "running", "workerId": worker_id, "lastHeartbeat": datetime.now(timezone.utc)},
+            "$inc": {"attempts": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    return run_from_doc(doc) if doc else None
+
+
+async def get_run_by_id(run_id: str) -> Optional[TestRun]:
+    collection = get_collection(TEST_RUNS_COLLECTION)
+    doc = await collection.find_one({"_id": ObjectId(run_id)})
+    return run_from_doc(doc) if doc else None
+
+
+def run_from_doc(doc) -> TestRun:
+    return TestRun(
+        id=str(doc["_id"]),
+        projectId=doc["projectId"],
+        name=doc["name"],
+        simulationIds=doc["simulationIds"],
+        workflowId=doc["workflowId"],
+        status=doc["status"],
+        startedAt=doc["startedAt"],
+        completedAt=doc.get("completedAt"),
+        aggregateResults=doc.get("aggregateResults"),
+        lastHeartbeat=doc.get("lastHeartbeat"),
+        workerId=doc.get("workerId"),
+        attempts=doc.get("attempts", 0),
+    )
+
+
+def watch_pending_runs():
+    """
+    Opens a change stream on `test_runs` that reports runs inserted as, or updated to, 'pending'.
+    Change streams need a replica set or sharded cluster; opening one on a standalone server fails.
+    """
+    collection = get_collection(TEST_RUNS_COLLECTION)
+    pipeline = [
+        {
+            "$match": {
+                "$or": [
+                    {"operationType": "insert", "fullDocument.status": "pending"},
+                    {"operationType": "update", "updateDescription.updatedFields.status": "pending"},
+                    {"operationType": "replace", "fullDocument.status": "pending"},
+                ]
+            }
+        }
+    ]
+    return collection.watch(pipeline)
 
 
-def set_run_to_completed(test_run: TestRun, aggregate: AggregateResults):
+async def set_run_to_completed(test_run: TestRun, aggregate: AggregateResults) -> bool:
     """
-    Marks a test run 'completed' and sets the aggregate results.
+    Marks a test run 'completed' and sets the aggregate results, unless the run's lease has passed to another
+    worker. Returns whether the run was updated.
     """
     collection = get_collection(TEST_RUNS_COLLECTION)
-    collection.update_one(
-        {"_id": ObjectId(test_run.id)},
+    result = await collection.update_one(
+        {"_id": ObjectId(test_run.id), "status": "running", "workerId": test_run.workerId},
         {
             "$set": {
                 "status": "completed",
@@ -78,27 +149,110 @@ def set_run_to_completed(test_run: TestRun, aggregate: AggregateResults):
             }
         },
     )
+    return result.modified_count == 1
 
 
-def update_run_heartbeat(run_id: str):
+async def update_run_heartbeat(run_id: str, worker_id: str) -> bool:
     """
-    Updates the 'lastHeartbeat' timestamp for a TestRun.
+    Renews the lease of `worker_id` on a running TestRun by updating its 'lastHeartbeat' timestamp.
+    Returns False when the lease was lost, i.e. the run was re-queued, taken over or cancelled.
     """
     collection = get_collection(TEST_RUNS_COLLECTION)
-    collection.update_one({"_id": ObjectId(run_id)}, {"$set": {"lastHeartbeat": datetime.now(timezone.utc)}})
+    result = await collection.update_one(
+        {"_id": ObjectId(run_id), "status": "running", "workerId": worker_id},
+        {"$set": {"lastHeartbeat": datetime.now(timezone.utc)}},
+    )
+    return result.matched_count == 1
 
 
-def mark_stale_jobs_as_failed(threshold_minutes: int = 20) -> int:
+async def requeue_stale_runs(threshold_minutes: int = 20, max_attempts: int = 3) -> tuple[int, int]:
     """
-    Finds any run in 'running' status whose lastHeartbeat is older than
-    `threshold_minutes`, and sets it to 'failed'. Returns the count.
+    Finds runs in 'running' status whose lastHeartbeat is older than `threshold_minutes`, i.e. whose worker died.
+    Runs with fewer than `max_attempts` attempts are set back to 'pending' so another worker resumes them from
+    their stored results; the others are set to 'failed'. Returns the counts of (re-queued, failed) runs.
     """
     collection = get_collection(TEST_RUNS_COLLECTION)
     stale_threshold = datetime.now(timezone.utc) - timedelta(minutes=threshold_minutes)
-    result = collection.update_many(
-        {"status": "running", "lastHeartbeat": {"$lt": stale_threshold}}, {"$set": {"status": "failed"}}
+    stale = {"status": "running", "lastHeartbeat": {"$lt": stale_threshold}}
+    requeued = await collection.update_many(
+        {**stale, "attempts": {"$not": {"$gte": max_attempts}}},
+        {"$set": {"status": "pending"}, "$unset": {"workerId": ""}},
+    )
+    failed = await collection.update_many(
+        {**stale, "attempts": {"$gte": max_attempts}}, {"$set": {"status": "failed"}, "$unset": {"workerId": ""}}
+    )
+    return requeued.modified_count, failed.modified_count
+
+
+async def start_sharded_run(test_run: TestRun, aggregate: AggregateResults, remaining: int) -> bool:
+    """
+    Hands a claimed run over to the simulation job queue: seeds its aggregate results with the simulations that
+    are already done and the number of simulations left, and releases the claiming worker's lease. From then on the
+    run is kept alive by the leases of its jobs, and completed by the job that finishes last.
+    Returns False when the run's lease was lost before the handoff.
+    """
+    collection = get_collection(TEST_RUNS_COLLECTION)
+    result = await collection.update_one(
+        {"_id": ObjectId(test_run.id), "status": "running", "workerId": test_run.workerId},
+        {
+            "$set": {
+                "aggregateResults": aggregate.model_dump(by_alias=True),
+                "remainingSimulations": remaining,
+                "turnsSaved": 0,
+                "shardedAt": datetime.now(timezone.utc),
+            },
+            # Without a heartbeat the run is no longer picked up by requeue_stale_runs
+            "$unset": {"workerId": "", "lastHeartbeat": ""},
+        },
     )
-    return result.modified_count
+    return result.modified_count == 1
+
+
+async def get_run_status(run_id: str) -> Optional[str]:
+    collection = get_collection(TEST_RUNS_COLLECTION)
+    doc = await collection.find_one({"_id": ObjectId(run_id)}, {"status": 1})
+    return doc["status"] if doc else None
+
+
+async def reconcile_sharded_runs(grace_minutes: int = 5) -> tuple[int, int]:
+    """
+    Repairs sharded runs that were handed over to the job queue more than `grace_minutes` ago but have no jobs
+    left to do, which happens when a worker dies between two steps of a handoff or a job completion.
+    Runs with a result for every simulation are completed with aggregates recomputed from the stored results; the
+    others are set back to 'pending' so their missing jobs are queued again. Returns the counts of (completed,
+    re-queued) runs.
+    """
+    runs = get_collection(TEST_RUNS_COLLECTION)
+    jobs = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    grace_threshold = datetime.now(timezone.utc) - timedelta(minutes=grace_minutes)
+    completed = requeued = 0
+    async for doc in runs.find({"status": "running", "shardedAt": {"$lt": grace_threshold}}):
+        run_id = str(doc["_id"])
+        if await jobs.count_documents({"runId": run_id, "status": {"$ne": "done"}}, limit=1):
+            continue
+
+        results = await get_results_for_run(run_id)
+        if all(simulation_id in results for simulation_id in doc["simulationIds"]):
+            outcomes = [results[simulation_id].result for simulation_id in doc["simulationIds"]]
+            aggregate = AggregateResults(
+                total=len(outcomes), passCount=outcomes.count("pass"), failCount=outcomes.count("fail")
+            )
+            update = {
+                "$set": {
+                    "status": "completed",
+                    "aggregateResults": aggregate.model_dump(by_alias=True),
+                    "completedAt": datetime.now(timezone.utc),
+                }
+            }
+        else:
+            update = {"$set": {"status": "pending"}, "$unset": {"shardedAt": ""}}
+        result = await runs.update_one({"_id": doc["_id"], "status": "running", "shardedAt": doc["shardedAt"]}, update)
+        if result.modified_count:
+            if update["$set"]["status"] == "completed":
+                completed += 1
+            else:
+                requeued += 1
+    return completed, requeued
 
 
 #
@@ -106,7 +260,7 @@ def mark_stale_jobs_as_failed(threshold_minutes: int = 20) -> int:
 #
 
 
-def get_simulations_for_run(test_run: TestRun) -> list[TestSimulation]:
+async def get_simulations_for_run(test_run: TestRun) -> list[TestSimulation]:
     """
     Returns all simulations specified by a particular run.
     """
@@ -116,7 +270,7 @@ def get_simulations_for_run(test_run: TestRun) -> list[TestSimulation]:
     simulation_docs = collection.find({"_id": {"$in": [ObjectId(sim_id) for sim_id in test_run.simulationIds]}})
 
     simulations = []
-    for doc in simulation_docs:
+    async for doc in simulation_docs:
         simulations.append(
             TestSimulation(
                 id=str(doc["_id"]),
@@ -132,14 +286,15 @@ def get_simulations_for_run(test_run: TestRun) -> list[TestSimulation]:
     return simulations
 
 
-def get_scenario_by_id(scenario_id: str) -> TestScenario:
+async def get_scenarios_by_ids(scenario_ids: list[str]) -> dict[str, TestScenario]:
     """
-    Returns a TestScenario by its ID.
+    Returns the TestScenarios with the given IDs in a single query, keyed by ID.
     """
     collection = get_collection(TEST_SCENARIOS_COLLECTION)
-    doc = collection.find_one({"_id": ObjectId(scenario_id)})
-    if doc:
-        return TestScenario(
+    cursor = collection.find({"_id": {"$in": [ObjectId(scenario_id) for scenario_id in set(scenario_ids)]}})
+    scenarios = {}
+    async for doc in cursor:
+        scenarios[str(doc["_id"])] = TestScenario(
             id=str(doc["_id"]),
             projectId=doc["projectId"],
             name=doc["name"],
@@ -147,7 +302,7 @@ def get_scenario_by_id(scenario_id: str) -> TestScenario:
             createdAt=doc["createdAt"],
             lastUpdatedAt=doc["lastUpdatedAt"],
         )
-    return None
+    return scenarios
 
 
 #
@@ -155,9 +310,246 @@ def get_scenario_by_id(scenario_id: str) -> TestScenario:
 #
 
 
-def write_test_result(result: TestResult):
+async def get_results_for_run(run_id: str) -> dict[str, TestResult]:
     """
-    Writes a test result into the `test_results` collection.
+    Returns the test results already stored for a run, keyed by simulation ID. These are the run's checkpoint.
     """
     collection = get_collection(TEST_RESULTS_COLLECTION)
-    collection.insert_one(result.model_dump())
+    results = {}
+    async for doc in collection.find({"runId": run_id}, {"_id": 0}):
+        results[doc["simulationId"]] = TestResult(**doc)
+    return results
+
+
+#
+# TestSimulationJob helpers
+#
+
+
+async def create_simulation_jobs(test_run: TestRun, simulation_ids: list[str]):
+    """
+    Queues one job per simulation of a run. Jobs that already exist, from an earlier attempt at the run, are left
+    as they are.
+    """
+    if not simulation_ids:
+        return
+    collection = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    now = datetime.now(timezone.utc)
+    await collection.bulk_write(
+        [
+            UpdateOne(
+                {"runId": test_run.id, "simulationId": simulation_id},
+                {
+                    "$setOnInsert": {
+                        "projectId": test_run.projectId,
+                        "workflowId": test_run.workflowId,
+                        "status": "pending",
+                        "attempts": 0,
+                        "createdAt": now,
+                    }
+                },
+                upsert=True,
+            )
+            for simulation_id in simulation_ids
+        ],
+        ordered=False,
+    )
+
+
+def job_from_doc(doc) -> TestSimulationJob:
+    return TestSimulationJob(
+        id=str(doc["_id"]),
+        runId=doc["runId"],
+        projectId=doc["projectId"],
+        simulationId=doc["simulationId"],
+        workflowId=doc["workflowId"],
+        status=doc["status"],
+        attempts=doc["attempts"],
+        workerId=doc.get("workerId"),
+        leaseExpiresAt=doc.get("leaseExpiresAt"),
+    )
+
+
+def watch_simulation_jobs():
+    """
+    Opens a change stream on `test_simulation_jobs` that reports newly queued jobs. Like `watch_pending_runs`, it
+    needs a replica set or sharded cluster.
+    """
+    collection = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    return collection.watch([{"$match": {"operationType": "insert"}}])
+
+
+async def claim_simulation_job(worker_id: str, lease_seconds: float) -> Optional[TestSimulationJob]:
+    """
+    Claims the oldest job that is pending or whose lease has expired, under a lease held by `worker_id` for
+    `lease_seconds`, and counts one attempt at it.
+    """
+    collection = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    now = datetime.now(timezone.utc)
+    doc = await collection.find_one_and_update(
+        {"$or": [{"status": "pending"}, {"status": "running", "leaseExpiresAt": {"$lt": now}}]},
+        {
+            "$set": {
+                "status": "running",
+                "workerId": worker_id,
+                "leaseExpiresAt": now + timedelta(seconds=lease_seconds),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("createdAt", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return job_from_doc(doc) if doc else None
+
+
+async def renew_simulation_job_leases(worker_id: str, job_ids: list[str], lease_seconds: float) -> set[str]:
+    """
+    Extends the leases of `worker_id` on the given running jobs. Returns the IDs of the jobs whose lease is still
+    held; the others were taken over by another worker after their lease expired.
+    """
+    if not job_ids:
+        return set()
+    collection = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    held = {"_id": {"$in": [ObjectId(job_id) for job_id in job_ids]}, "status": "running", "workerId": worker_id}
+    lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    await collection.update_many(held, {"$set": {"leaseExpiresAt": lease_expires_at}})
+    return {str(doc["_id"]) async for doc in collection.find(held, {"_id": 1})}
+
+
+async def release_simulation_job(job: TestSimulationJob):
+    """
+    Marks a job done without a result, e.g. because its run was cancelled.
+    """
+    collection = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    await collection.update_one(
+        {"_id": ObjectId(job.id), "status": "running", "workerId": job.workerId},
+        {"$set": {"status": "done"}, "$unset": {"leaseExpiresAt": ""}},
+    )
+
+
+async def complete_simulation_jobs(worker_id: str, completions: list[tuple[TestSimulationJob, TestResult]]) -> dict:
+    """
+    Stores the results of finished jobs, marks the jobs done and adds the results to their runs' aggregate results
+    with one atomic $inc per run. A run whose remaining simulations reach zero is marked 'completed'.
+
+    Results are stored before the jobs are released, so a worker dying in between only causes the simulations to be
+    run again; their results then replace the stored ones. Nothing is added to a run for a job whose lease was lost.
+    A batch costs one write for the results, two for the jobs and one or two per run.
+
+    Returns the documents of the runs this batch completed, keyed by run ID.
+    """
+    if not completions:
+        return {}
+    await get_collection(TEST_RESULTS_COLLECTION).bulk_write(
+        [
+            ReplaceOne({"runId": result.runId, "simulationId": result.simulationId}, result.model_dump(), upsert=True)
+            for _, result in completions
+        ],
+        ordered=False,
+    )
+
+    # Each release is tagged, so the jobs whose lease was still held can be read back
+    jobs = get_collection(TEST_SIMULATION_JOBS_COLLECTION)
+    job_ids = {"$in": [ObjectId(job.id) for job, _ in completions]}
+    release_id = ObjectId()
+    await jobs.update_many(
+        {"_id": job_ids, "status": "running", "workerId": worker_id},
+        {"$set": {"status": "done", "releaseId": release_id}, "$unset": {"leaseExpiresAt": ""}},
+    )
+    released = {str(doc["_id"]) async for doc in jobs.find({"_id": job_ids, "releaseId": release_id}, {"_id": 1})}
+
+    increments = {}
+    for job, result in completions:
+        if job.id not in released:
+            continue
+        count_field = "aggregateResults.passCount" if result.result == "pass" else "aggregateResults.failCount"
+        inc = increments.setdefault(
+            job.runId,
+            {
+                "aggregateResults.total": 0,
+                "aggregateResults.passCount": 0,
+                "aggregateResults.failCount": 0,
+                "remainingSimulations": 0,
+                "turnsSaved": 0,
+            },
+        )
+        inc["aggregateResults.total"] += 1
+        inc[count_field] += 1
+        inc["remainingSimulations"] -= 1
+        inc["turnsSaved"] += result.turnsSaved or 0
+
+    runs = get_collection(TEST_RUNS_COLLECTION)
+    completed_runs = {}
+    for run_id, inc in increments.items():
+        run = await runs.find_one_and_update(
+            {"_id": ObjectId(run_id), "status": "running"}, {"$inc": inc}, return_document=ReturnDocument.AFTER
+        )
+        if run is None or run["remainingSimulations"] > 0:
+            continue
+        completed = await runs.update_one(
+            {"_id": run["_id"], "status": "running", "remainingSimulations": {"$lte": 0}},
+            {"$set": {"status": "completed", "completedAt": datetime.now(timezone.utc)}},
+        )
+        if completed.modified_count:
+            completed_runs[run_id] = run
+    return completed_runs
+
+
+class SimulationJobCompleter:
+    """
+    Buffers finished jobs and completes them with `complete_simulation_jobs` once RESULT_BATCH_SIZE are pending or
+    the oldest has waited RESULT_FLUSH_SECONDS. `close()` completes whatever is left.
+
+    `complete` returns a future, so a job can wait for its batch and keep its lease renewed in the meantime.
+    """
+
+    def __init__(
+        self, worker_id: str, batch_size: int = RESULT_BATCH_SIZE, flush_seconds: float = RESULT_FLUSH_SECONDS
+    ):
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.pending: list[tuple[TestSimulationJob, TestResult, asyncio.Future]] = []
+        self.flush_timer: Optional[asyncio.TimerHandle] = None
+        self.flushes: set[asyncio.Task] = set()
+
+    def complete(self, job: TestSimulationJob, result: TestResult) -> asyncio.Future:
+        """
+        Queues a finished job. The returned future resolves, once its batch is written, to the run document if the
+        batch completed the job's run and this job was the run's last in the batch, and to None otherwise.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((job, result, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(self.flush_seconds, self.flush)
+        return future
+
+    def flush(self):
+        # Batches are written in their own task, so a job cancelled while waiting does not stop the others' writes
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self.write(batch))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def write(self, batch: list[tuple[TestSimulationJob, TestResult, asyncio.Future]]):
+        try:
+            completed_runs = await complete_simulation_jobs(self.worker_id, [(job, result) for job, result, _ in batch])
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        last_of_run = {job.runId: future for job, _, future in batch}
+        for job, _, future in batch:
+            if not future.done():
+                future.set_result(completed_runs.get(job.runId) if last_of_run[job.runId] is future else None)
+
+    async def close(self):
+        self.flush()
+        await asyncio.gather(*self.flushes, return_exceptions=True)
@@ -0,0 +1,299 @@
+"""
+Deterministic offline replay mode for load testing the simulation runner itself.
+
+The model playing the customer and the evaluator is replaced by a scripted stand-in, and the bot under test by a
+local Rowboat stand-in served from an httpx transport; both answer after a configurable, seeded latency. No model or
+Rowboat API is called. MongoDB is real, so run this against a disposable MongoDB (MONGODB_URI): the load test seeds
+its own project, runs and simulations there and deletes them afterwards.
+
+Usage:
+    python replay.py --runs 10 --simulations 50 --workers 2 --output replay.json
+    python replay.py --runs 1 --simulations 500 --llm_latency_ms 800 --bot_latency_ms 2000
+
+Services started with SIMULATION_REPLAY=true use the same stand-ins, so `--workers 0` load tests separate runner
+processes: the command then only seeds the runs and measures until they are completed. Call and MongoDB command
+counts cover in-process workers only.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import httpx
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from openai.types.chat import ChatCompletion
+from pymongo import monitoring
+
+import db
+import rowboat_client
+import simulation
+
+REPLAY = os.environ.get("SIMULATION_REPLAY", "false").lower() == "true"
+# Stand-in latencies; each call waits the latency +/- up to REPLAY_LATENCY_JITTER of it
+REPLAY_LLM_LATENCY_MS = float(os.environ.get("REPLAY_LLM_LATENCY_MS", "500"))
+REPLAY_BOT_LATENCY_MS = float(os.environ.get("REPLAY_BOT_LATENCY_MS", "1000"))
+REPLAY_LATENCY_JITTER = float(os.environ.get("REPLAY_LATENCY_JITTER", "0.2"))
+# Customer turns before the scripted customer ends the conversation
+REPLAY_TURNS = int(os.environ.get("REPLAY_TURNS", "3"))
+REPLAY_SEED = int(os.environ.get("REPLAY_SEED", "0"))
+
+
+class Latency:
+    def __init__(self, latency_ms: float, jitter: float, seed: int):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    async def wait(self):
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms * (1 + self.random.uniform(-self.jitter, self.jitter)) / 1000)
+
+
+def digest(value) -> int:
+    return int.from_bytes(hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).digest()[:8], "little")
+
+
+class ScriptedCompletions:
+    """
+    Stand-in for `AsyncOpenAI().chat.completions`. The customer sends numbered messages and ends the conversation
+    after `turns` of them; the evaluator's verdict is derived from the transcript, so it is the same on every replay.
+    """
+
+    def __init__(self, latency: Latency, turns: int):
+        self.latency = latency
+        self.turns = turns
+        self.calls = 0
+
+    async def create(self, model: str, messages: list, **kwargs) -> ChatCompletion:
+        await self.latency.wait()
+        self.calls += 1
+        if "response_format" in kwargs:
+            verdict = "fail" if digest(messages) % 4 == 0 else "pass"
+            content = json.dumps({"verdict": verdict, "details": "Scripted verdict"})
+        else:
+            turn = sum(1 for message in messages if message["role"] == "assistant")
+            content = simulation.END_CONVERSATION_TOKEN if turn >= self.turns else f"Scripted customer message {turn}"
+        return ChatCompletion(
+            id=f"replay-{self.calls}",
+            created=int(time.time()),
+            model=model,
+            object="chat.completion",
+            choices=[
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+            ],
+        )
+
+
+class ScriptedRowboatTransport(httpx.AsyncBaseTransport):
+    """
+    Stand-in for the Rowboat chat API: answers every turn with a numbered external assistant message.
+    """
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.latency.wait()
+        self.calls += 1
+        body = json.loads(await request.aread())
+        turn = sum(1 for message in body["messages"] if message["role"] == "user")
+        return httpx.Response(
+            200,
+            json={
+                "messages": [
+                    {"role": "assistant", "content": f"Scripted reply {turn}", "agenticResponseType": "external"}
+                ],
+                "state": {"turn": turn},
+            },
+        )
+
+
+def install_replay(
+    llm_latency_ms: float = REPLAY_LLM_LATENCY_MS,
+    bot_latency_ms: float = REPLAY_BOT_LATENCY_MS,
+    jitter: float = REPLAY_LATENCY_JITTER,
+    turns: int = REPLAY_TURNS,
+    seed: int = REPLAY_SEED,
+):
+    """
+    Replaces the runner's OpenAI client and Rowboat connection pool with the scripted stand-ins.
+
+    Returns:
+        tuple: The (ScriptedCompletions, ScriptedRowboatTransport) stand-ins, which count their calls.
+    """
+    completions = ScriptedCompletions(Latency(llm_latency_ms, jitter, seed), turns)
+    transport = ScriptedRowboatTransport(Latency(bot_latency_ms, jitter, seed + 1))
+    simulation.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    rowboat_client.http_client = httpx.AsyncClient(transport=transport)
+    return completions, transport
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Counts the commands sent to MongoDB, by command name.
+    """
+
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed_runs(project_id: str, runs: int, simulations: int) -> list[ObjectId]:
+    now = datetime.now(timezone.utc)
+    scenario = await db.get_collection(db.TEST_SCENARIOS_COLLECTION).insert_one(
+        {
+            "projectId": project_id,
+            "name": "Replay scenario",
+            "description": "Ask about the status of an order.",
+            "createdAt": now,
+            "lastUpdatedAt": now,
+        }
+    )
+    simulation_docs = [
+        {
+            "projectId": project_id,
+            "name": f"Replay simulation {i}",
+            "scenarioId": str(scenario.inserted_id),
+            "profileId": "replay",
+            "passCriteria": "The bot answers the question.",
+            "createdAt": now,
+            "lastUpdatedAt": now,
+        }
+        for i in range(simulations)
+    ]
+    simulation_ids = (await db.get_collection(db.TEST_SIMULATIONS_COLLECTION).insert_many(simulation_docs)).inserted_ids
+    run_docs = [
+        {
+            "projectId": project_id,
+            "name": f"Replay run {i}",
+            "simulationIds": [str(simulation_id) for simulation_id in simulation_ids],
+            "workflowId": "replay",
+            "status": "pending",
+            "startedAt": now,
+        }
+        for i in range(runs)
+    ]
+    return (await db.get_collection(db.TEST_RUNS_COLLECTION).insert_many(run_docs)).inserted_ids
+
+
+async def cleanup(project_id: str, run_ids: list[ObjectId]):
+    runs = [str(run_id) for run_id in run_ids]
+    await db.get_collection(db.TEST_RESULTS_COLLECTION).delete_many({"runId": {"$in": runs}})
+    await db.get_collection(db.TEST_SIMULATION_JOBS_COLLECTION).delete_many({"runId": {"$in": runs}})
+    for collection in (db.TEST_RUNS_COLLECTION, db.TEST_SIMULATIONS_COLLECTION, db.TEST_SCENARIOS_COLLECTION):
+        await db.get_collection(collection).delete_many({"projectId": project_id})
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def main(args):
+    from service import JobService
+
+    counter = CommandCounter()
+    db.mongo_client = AsyncIOMotorClient(db.MONGO_URI, event_listeners=[counter])
+    completions, transport = install_replay(
+        args.llm_latency_ms, args.bot_latency_ms, args.jitter, args.turns, args.seed
+    )
+    await db.ensure_indexes()
+
+    project_id = f"replay-{uuid.uuid4().hex[:8]}"
+    run_ids = await seed_runs(project_id, args.runs, args.simulations)
+    total_simulations = args.runs * args.simulations
+    print(f"Seeded {args.runs} runs of {args.simulations} simulations in project {project_id}")
+
+    workers = []
+    for i in range(args.workers):
+        worker = JobService()
+        worker.worker_id = f"{project_id}-worker-{i}"
+        worker.max_concurrent_simulations = args.concurrency
+        workers.append(worker)
+
+    rss_before = max_rss_mb()
+    counter.commands.clear()
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(worker.poll_and_process_jobs()) for worker in workers]
+    # Progress is polled through a separate client so it is not counted as load from the runner
+    harness_client = AsyncIOMotorClient(db.MONGO_URI)
+    runs_collection = harness_client["rowboat"][db.TEST_RUNS_COLLECTION]
+    try:
+        while True:
+            completed = await runs_collection.count_documents(
+                {"_id": {"$in": run_ids}, "status": {"$in": ["completed", "failed", "error"]}}
+            )
+            if completed == len(run_ids):
+                break
+            if time.perf_counter() - start > args.timeout:
+                print(f"Timed out with {completed} of {len(run_ids)} runs finished")
+                break
+            await asyncio.sleep(0.5)
+        elapsed = time.perf_counter() - start
+        commands = counter.commands.copy()
+    finally:
+        for task in tasks:
+            task.cancel()
+        harness_client.close()
+        if not args.keep_data:
+            await cleanup(project_id, run_ids)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **{key: value for key, value in vars(args).items() if key != "output"},
+        },
+        "elapsed_seconds": elapsed,
+        "simulations_per_second": total_simulations / elapsed,
+        "llm_calls": completions.calls,
+        "bot_calls": transport.calls,
+        "mongo_commands": dict(commands),
+        "mongo_commands_per_simulation": sum(commands.values()) / total_simulations,
+        "max_rss_mb": max_rss_mb(),
+        "rss_growth_mb": max_rss_mb() - rss_before,
+    }
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"Wrote results to {args.output}")
+    db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the simulation runner against scripted stand-ins")
+    parser.add_argument("--runs", type=int, default=5, help="Runs to seed")
+    parser.add_argument("--simulations", type=int, default=20, help="Simulations per run")
+    parser.add_argument("--workers", type=int, default=1, help="In-process JobService instances; 0 uses external ones")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent simulations per worker")
+    parser.add_argument("--llm_latency_ms", type=float, default=REPLAY_LLM_LATENCY_MS, help="Model stand-in latency")
+    parser.add_argument("--bot_latency_ms", type=float, default=REPLAY_BOT_LATENCY_MS, help="Rowboat stand-in latency")
+    parser.add_argument("--jitter", type=float, default=REPLAY_LATENCY_JITTER, help="Latency jitter, as a fraction")
+    parser.add_argument("--turns", type=int, default=REPLAY_TURNS, help="Customer turns per conversation")
+    parser.add_argument("--seed", type=int, default=REPLAY_SEED, help="Seed of the latency jitter")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the runs to finish")
+    parser.add_argument("--keep_data", action="store_true", help="Keep the seeded runs and their results")
+    parser.add_argument("--output", type=str, default=None, help="File to write the JSON results to")
+    asyncio.run(main(parser.parse_args()))
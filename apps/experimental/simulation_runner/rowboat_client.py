@@ -0,0 +1,92 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import httpx
+from rowboat import ApiMessage, ApiRequest, ApiResponse, AssistantMessage, AssistantMessageWithToolCalls, UserMessage
+
+ROWBOAT_TIMEOUT = float(os.environ.get("ROWBOAT_TIMEOUT", "300"))
+
+# One connection pool shared by every chat; concurrency is bounded by the callers, not by the pool
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=ROWBOAT_TIMEOUT, limits=httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+class AsyncClient:
+    """
+    Async counterpart of rowboat.Client, for running many conversations on one event loop.
+    """
+
+    def __init__(self, host: str, project_id: str, api_key: str) -> None:
+        self.base_url: str = f"{host}/api/v1/{project_id}/chat"
+        self.headers: Dict[str, str] = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+
+    async def chat(
+        self,
+        messages: List[ApiMessage],
+        state: Optional[Dict[str, Any]] = None,
+        workflow_id: Optional[str] = None,
+        test_profile_id: Optional[str] = None,
+    ) -> ApiResponse:
+        """Stateless chat method that handles a single conversation turn"""
+        request = ApiRequest(messages=messages, state=state, workflowId=workflow_id, testProfileId=test_profile_id)
+        response = await get_http_client().post(self.base_url, headers=self.headers, json=request.model_dump())
+
+        if not response.status_code == 200:
+            raise ValueError(f"Error: {response.status_code} - {response.text}")
+
+        response_data = ApiResponse.model_validate(response.json())
+
+        if not response_data.messages:
+            raise ValueError("No response")
+
+        last_message = response_data.messages[-1]
+        if not isinstance(last_message, (AssistantMessage, AssistantMessageWithToolCalls)):
+            raise ValueError("Last message was not an assistant message")
+
+        if not last_message.agenticResponseType == "external":
+            raise ValueError("Last message was not an external message")
+
+        return response_data
+
+
+class AsyncStatefulChat:
+    """Maintains conversation state across multiple turns"""
+
+    def __init__(
+        self, client: AsyncClient, workflow_id: Optional[str] = None, test_profile_id: Optional[str] = None
+    ) -> None:
+        self.client = client
+        self.messages: List[ApiMessage] = []
+        self.state: Optional[Dict[str, Any]] = None
+        self.workflow_id = workflow_id
+        self.test_profile_id = test_profile_id
+
+    async def run(self, message: str) -> str:
+        """Handle a single user turn in the conversation"""
+        self.messages.append(UserMessage(role="user", content=message))
+
+        response_data = await self.client.chat(
+            messages=self.messages, state=self.state, workflow_id=self.workflow_id, test_profile_id=self.test_profile_id
+        )
+
+        # Update internal state
+        self.messages.extend(response_data.messages)
+        self.state = response_data.state
+
+        # Return only the final message content
+        return self.messages[-1].content
@@ -44,6 +44,25 @@ class TestRun(BaseModel):
     completedAt: Optional[datetime] = None
     aggregateResults: Optional[AggregateResults] = None
     lastHeartbeat: Optional[datetime] = None
+    # Lease of the runner instance processing the run, and how many times the run has been claimed
+    workerId: Optional[str] = None
+    attempts: int = 0
+
+
+# A simulation of a run, queued for any runner instance to claim under a lease
+SimulationJobStatus = Literal["pending", "running", "done"]
+
+
+class TestSimulationJob(BaseModel):
+    id: str
+    runId: str
+    projectId: str
+    simulationId: str
+    workflowId: str
+    status: SimulationJobStatus
+    attempts: int = 0
+    workerId: Optional[str] = None
+    leaseExpiresAt: Optional[datetime] = None
 
 
 class TestResult(BaseModel):
@@ -53,3 +72,6 @@ class TestResult(BaseModel):
     result: Literal["pass", "fail"]
     details: str
     transcript: str
+    # Conversation turns taken, and turns skipped by ending the conversation before max_iterations
+    turns: Optional[int] = None
+    turnsSaved: Optional[int] = None
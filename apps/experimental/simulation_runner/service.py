@@ -1,106 +1,397 @@
 import asyncio
 import logging
-from typing import List, Optional
+import os
+import socket
+import time
+import uuid
+from typing import Optional
 
 # Updated imports from your new db module and scenario_types
 from db import (
     get_pending_run,
+    get_run_by_id,
     get_simulations_for_run,
+    get_scenarios_by_ids,
+    get_results_for_run,
+    get_run_status,
     set_run_to_completed,
+    start_sharded_run,
     get_api_key,
-    mark_stale_jobs_as_failed,
+    requeue_stale_runs,
+    reconcile_sharded_runs,
     update_run_heartbeat,
+    create_simulation_jobs,
+    claim_simulation_job,
+    renew_simulation_job_leases,
+    release_simulation_job,
+    SimulationJobCompleter,
+    ensure_indexes,
+    close_db,
+    watch_pending_runs,
+    watch_simulation_jobs,
 )
-from scenario_types import TestRun, TestSimulation
+from scenario_types import AggregateResults, TestResult, TestRun, TestSimulationJob
 
-# If you have a new simulation function, import it here.
-# Otherwise, adapt the name as needed:
-from simulation import simulate_simulations  # or simulate_scenarios, if unchanged
+from simulation import ROWBOAT_API_HOST, run_simulation
+from rowboat_client import AsyncClient, close_http_client
+from replay import REPLAY, install_replay
 
 logging.basicConfig(level=logging.INFO)
 
 
 class JobService:
+    """
+    Processes test runs as a queue of simulation jobs shared by every runner instance.
+
+    A worker that claims a pending run queues one job per simulation and hands the run over to the queue. Any worker
+    then claims individual jobs under a lease, so a run is spread over all instances, and the job that finishes last
+    completes the run. What the jobs of a run share is loaded once per run on each worker, and finished jobs are
+    completed in batches.
+    """
+
     def __init__(self):
+        # Polling interval without change streams, and the safety-net interval while they are open
         self.poll_interval = 5  # seconds
-        # Control concurrency of run processing
-        self.semaphore = asyncio.Semaphore(5)
+        self.watch_poll_interval = 30  # seconds
+        self.change_stream_retry_interval = 60  # seconds
+        # Control concurrency of run processing (queueing a run's jobs) and of simulations on this worker
+        self.max_concurrent_runs = 5
+        self.max_concurrent_simulations = int(os.environ.get("SIMULATION_CONCURRENCY", "20"))
+        self.active_runs = set()
+        self.active_jobs: dict[str, asyncio.Task] = {}
+        # Jobs done simulating that wait for their batch to be written; they do not count against the concurrency
+        self.completing_jobs = set()
+        self.lost_jobs = set()
+        self.change_streams = {"test_runs": watch_pending_runs, "test_simulation_jobs": watch_simulation_jobs}
+        self.active_change_streams = set()
+        self.wakeup = asyncio.Event()
+        # Identifies this instance in the leases of the runs and jobs it processes, so several instances can share work
+        self.worker_id = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # A run whose heartbeat is older than this is re-queued, unless it has been attempted max_run_attempts times
+        self.stale_run_minutes = 20
+        self.max_run_attempts = 3
+        # Job leases are renewed while the simulation runs; a job attempted more often is recorded as failed
+        self.job_lease_seconds = 120
+        self.job_lease_renew_interval = 30  # seconds
+        self.max_simulation_attempts = 3
+        # Run ID -> task loading what the run's jobs share (see get_run_context). The run's status is read again at
+        # most every run_status_ttl seconds, and a context unused for run_context_idle_seconds is dropped
+        self.run_contexts: dict[str, asyncio.Task] = {}
+        self.run_status_ttl = 10  # seconds
+        self.run_context_idle_seconds = 300
+        # Created once the worker ID is final, in poll_and_process_jobs
+        self.completer: Optional[SimulationJobCompleter] = None
+        # Stale-run check, lease renewal and change stream watchers; cancelled on shutdown
+        self.background_tasks: set[asyncio.Task] = set()
 
     async def poll_and_process_jobs(self, max_iterations: Optional[int] = None):
         """
-        Periodically checks for new runs in MongoDB and processes them.
+        Claims pending runs and simulation jobs whenever a change stream reports one, a run or job finishes or the
+        polling interval elapses, and processes them.
         """
-        # Start the stale-run check in the background
-        asyncio.create_task(self.fail_stale_runs_loop())
+        await ensure_indexes()
+        self.completer = SimulationJobCompleter(self.worker_id)
+
+        # Start the stale-run check, the lease renewal and the change stream watchers in the background
+        self.start_background_task(self.requeue_stale_runs_loop())
+        self.start_background_task(self.renew_job_leases_loop())
+        for name, open_stream in self.change_streams.items():
+            self.start_background_task(self.watch_loop(name, open_stream))
 
         iterations = 0
         while True:
-            run = get_pending_run()  # <--- changed to match new DB function
-            if run:
-                logging.info(f"Found new run: {run}. Processing...")
-                asyncio.create_task(self.process_run(run))
+            await self.claim_pending_runs()
+            await self.claim_simulation_jobs()
 
             iterations += 1
             if max_iterations is not None and iterations >= max_iterations:
                 break
 
-            # Sleep for the polling interval
-            await asyncio.sleep(self.poll_interval)
+            # Sleep until woken up or for the polling interval
+            watching = self.active_change_streams == set(self.change_streams)
+            interval = self.watch_poll_interval if watching else self.poll_interval
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
 
-    async def process_run(self, run: TestRun):
+    def start_background_task(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.on_background_task_done)
+
+    def on_background_task_done(self, task: asyncio.Task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Background task {task.get_coro().__qualname__} stopped: {task.exception()!r}")
+
+    async def stop_background_tasks(self):
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+
+    async def claim_pending_runs(self):
         """
-        Calls the simulation function and updates run status upon completion.
+        Claims and starts pending runs until none are left or the service is at capacity.
         """
-        async with self.semaphore:
-            # Start heartbeat in background
-            stop_heartbeat_event = asyncio.Event()
-            heartbeat_task = asyncio.create_task(self.heartbeat_loop(run.id, stop_heartbeat_event))
+        while len(self.active_runs) < self.max_concurrent_runs:
+            run = await get_pending_run(self.worker_id)
+            if not run:
+                break
+            logging.info(f"Found new run: {run}. Processing...")
+            task = asyncio.create_task(self.process_run(run))
+            self.active_runs.add(task)
+            task.add_done_callback(self.on_run_done)
+
+    def on_run_done(self, task: asyncio.Task):
+        self.active_runs.discard(task)
+        # Capacity was freed, or jobs were queued, so there is more work to claim
+        self.wakeup.set()
+
+    async def claim_simulation_jobs(self):
+        """
+        Claims and starts simulation jobs until none are left or the service is at capacity.
+        """
+        while len(self.active_jobs) - len(self.completing_jobs) < self.max_concurrent_simulations:
+            job = await claim_simulation_job(self.worker_id, self.job_lease_seconds)
+            if not job:
+                break
+            task = asyncio.create_task(self.process_simulation_job(job))
+            self.active_jobs[job.id] = task
+            task.add_done_callback(lambda _, job_id=job.id: self.on_job_done(job_id))
 
+    def on_job_done(self, job_id: str):
+        self.active_jobs.pop(job_id, None)
+        self.completing_jobs.discard(job_id)
+        self.lost_jobs.discard(job_id)
+        self.wakeup.set()
+
+    async def watch_loop(self, name: str, open_stream):
+        """
+        Wakes up the claim loop whenever the change stream opened by `open_stream` reports new work. Falls back to
+        polling while no change stream can be opened, e.g. on a standalone MongoDB server.
+        """
+        while True:
             try:
-                # Fetch the simulations associated with this run
-                simulations = get_simulations_for_run(run)
-                if not simulations:
-                    logging.info(f"No simulations found for run {run.id}")
-                    return
-
-                # Fetch API key if needed
-                api_key = get_api_key(run.projectId)
-
-                # Perform your simulation logic
-                # adapt this call to your actual simulation function’s signature
-                aggregate_result = await simulate_simulations(
-                    simulations=simulations, run_id=run.id, workflow_id=run.workflowId, api_key=api_key
+                async with open_stream() as stream:
+                    self.active_change_streams.add(name)
+                    logging.info(f"Watching {name} for new work.")
+                    async for _ in stream:
+                        self.wakeup.set()
+            except Exception as exc:
+                logging.warning(
+                    f"Change stream on {name} unavailable, polling every {self.poll_interval}s instead: {exc}"
                 )
+            self.active_change_streams.discard(name)
+            await asyncio.sleep(self.change_stream_retry_interval)
+
+    async def process_run(self, run: TestRun):
+        """
+        Queues a job for each simulation of the run and hands the run over to the job queue.
+        Simulations that already have a stored result, from an earlier attempt at the run, are not queued again.
+        Processing stops if the run's lease is lost.
+        """
+        # Start heartbeat in background
+        stop_heartbeat_event = asyncio.Event()
+        heartbeat_task = asyncio.create_task(
+            self.heartbeat_loop(run.id, stop_heartbeat_event, asyncio.current_task())
+        )
+
+        try:
+            # Fetch the simulations associated with this run
+            simulations = await get_simulations_for_run(run)
+            if not simulations:
+                logging.info(f"No simulations found for run {run.id}")
+                return
 
-                # Mark run as completed with the aggregated result
-                set_run_to_completed(run, aggregate_result)
-                logging.info(f"Run {run.id} completed.")
+            completed = await get_results_for_run(run.id)
+            done = [completed[simulation.id].result for simulation in simulations if simulation.id in completed]
+            remaining = [simulation.id for simulation in simulations if simulation.id not in completed]
+            aggregate = AggregateResults(total=len(done), passCount=done.count("pass"), failCount=done.count("fail"))
+
+            if not remaining:
+                if await set_run_to_completed(run, aggregate):
+                    logging.info(f"Run {run.id} completed.")
+                return
+
+            # The run is handed over before its jobs are queued, so no job can finish before the run counts it. The
+            # heartbeat is stopped first: a heartbeat after the handoff would find no lease and cancel the queueing
+            stop_heartbeat_event.set()
+            if await heartbeat_task:
+                return
+            if not await start_sharded_run(run, aggregate, len(remaining)):
+                logging.warning(f"Run {run.id} lost its lease before its simulations were queued.")
+                return
+            await create_simulation_jobs(run, remaining)
+            logging.info(f"Run {run.id}: queued {len(remaining)} simulations, {len(done)} already done.")
+        except asyncio.CancelledError:
+            # Only a heartbeat that lost the lease returns True
+            if not heartbeat_task.done() or heartbeat_task.result() is not True:
+                raise
+            logging.warning(f"Stopped processing run {run.id}: lease lost.")
+        except Exception as exc:
+            logging.error(f"Run {run.id} failed: {exc}")
+        finally:
+            stop_heartbeat_event.set()
+            await heartbeat_task
+
+    async def process_simulation_job(self, job: TestSimulationJob):
+        """
+        Runs the simulation of a job and records its result with the job's run. A job that raises keeps its lease
+        until it expires and is then retried; a job attempted more than max_simulation_attempts times is recorded as
+        failed without running it again.
+        """
+        try:
+            context = await self.get_run_context(job.runId)
+            if context["status"] != "running":
+                # The run was cancelled or finished in the meantime
+                await release_simulation_job(job)
+                return
+
+            simulation = context["simulations"].get(job.simulationId)
+            if simulation is None:
+                details = "Simulation not found"
+            elif job.attempts > self.max_simulation_attempts:
+                details = f"Simulation abandoned after {job.attempts - 1} attempts"
+            else:
+                details = None
+
+            if details:
+                result = TestResult(
+                    projectId=job.projectId,
+                    runId=job.runId,
+                    simulationId=job.simulationId,
+                    result="fail",
+                    details=details,
+                    transcript="[]",
+                )
+            else:
+                scenario = context["scenarios"].get(simulation.scenarioId)
+                result = await run_simulation(
+                    simulation, scenario, job.runId, job.projectId, context["client"], job.workflowId
+                )
+
+            # Waits for the job's batch to be written, so the job's lease is renewed until then, but frees its slot
+            completion = self.completer.complete(job, result)
+            self.completing_jobs.add(job.id)
+            self.wakeup.set()
+            run = await completion
+            if run is not None:
+                logging.info(
+                    f"Run {job.runId} completed: {run['aggregateResults']}, "
+                    f"{run['turnsSaved']} turns saved by early termination."
+                )
+        except asyncio.CancelledError:
+            if job.id not in self.lost_jobs:
+                raise
+            logging.warning(f"Stopped simulation job {job.id} of run {job.runId}: lease lost.")
+        except Exception as exc:
+            logging.error(f"Simulation job {job.id} of run {job.runId} failed: {exc}")
+
+    async def get_run_context(self, run_id: str) -> dict:
+        """
+        Returns what the jobs of a run share: the run's status, and for a running run its simulations and scenarios
+        keyed by ID and a Rowboat client for its project. They are loaded once per run, with one query each, and
+        reused by every job of the run on this worker; the status is read again at most every run_status_ttl
+        seconds.
+        """
+        now = time.monotonic()
+        for cached_run_id, loading in list(self.run_contexts.items()):
+            if loading.done() and (
+                loading.cancelled()
+                or loading.exception() is not None
+                or now - loading.result()["usedAt"] > self.run_context_idle_seconds
+            ):
+                del self.run_contexts[cached_run_id]
+
+        loading = self.run_contexts.get(run_id)
+        if loading is None:
+            loading = asyncio.create_task(self.load_run_context(run_id))
+            self.run_contexts[run_id] = loading
+        # Shielded, so a job cancelled while waiting does not cancel the load for the other jobs of the run
+        context = await asyncio.shield(loading)
+        context["usedAt"] = time.monotonic()
+        if context["status"] == "running" and context["usedAt"] - context["statusCheckedAt"] > self.run_status_ttl:
+            context["statusCheckedAt"] = context["usedAt"]
+            context["status"] = await get_run_status(run_id)
+        return context
+
+    async def load_run_context(self, run_id: str) -> dict:
+        run = await get_run_by_id(run_id)
+        context = {"status": run.status if run else None, "statusCheckedAt": time.monotonic(), "usedAt": 0}
+        if context["status"] != "running":
+            return context
+
+        simulations, api_key = await asyncio.gather(get_simulations_for_run(run), get_api_key(run.projectId))
+        context["simulations"] = {simulation.id: simulation for simulation in simulations}
+        context["scenarios"] = await get_scenarios_by_ids([simulation.scenarioId for simulation in simulations])
+        context["client"] = AsyncClient(host=ROWBOAT_API_HOST, project_id=run.projectId, api_key=api_key)
+        return context
+
+    async def renew_job_leases_loop(self):
+        """
+        Periodically renews the leases of the jobs this worker is running, and stops the jobs whose lease was lost.
+        """
+        while True:
+            await asyncio.sleep(self.job_lease_renew_interval)
+            job_ids = list(self.active_jobs)
+            try:
+                held = await renew_simulation_job_leases(self.worker_id, job_ids, self.job_lease_seconds)
             except Exception as exc:
-                logging.error(f"Run {run.id} failed: {exc}")
-            finally:
-                stop_heartbeat_event.set()
-                await heartbeat_task
+                logging.error(f"Failed to renew simulation job leases: {exc}")
+                continue
+            for job_id in job_ids:
+                task = self.active_jobs.get(job_id)
+                if job_id not in held and task is not None:
+                    self.lost_jobs.add(job_id)
+                    task.cancel()
 
-    async def fail_stale_runs_loop(self):
+    async def requeue_stale_runs_loop(self):
         """
-        Periodically checks for stale runs (no heartbeat) and marks them as 'failed'.
+        Periodically checks for stale runs (no heartbeat) and re-queues them, or marks them as 'failed' once they
+        have been attempted too often. Also repairs sharded runs left unfinished by a worker that died.
         """
         while True:
-            count = mark_stale_jobs_as_failed()
-            if count > 0:
-                logging.warning(f"Marked {count} stale runs as failed.")
+            try:
+                requeued, failed = await requeue_stale_runs(self.stale_run_minutes, self.max_run_attempts)
+                if requeued > 0:
+                    logging.warning(f"Re-queued {requeued} stale runs.")
+                    self.wakeup.set()
+                if failed > 0:
+                    logging.warning(f"Marked {failed} stale runs as failed after {self.max_run_attempts} attempts.")
+            except Exception as exc:
+                logging.error(f"Failed to re-queue stale runs: {exc}")
+            try:
+                completed, requeued = await reconcile_sharded_runs()
+                if completed or requeued:
+                    logging.warning(f"Reconciled sharded runs: {completed} completed, {requeued} re-queued.")
+                    self.wakeup.set()
+            except Exception as exc:
+                logging.error(f"Failed to reconcile sharded runs: {exc}")
             await asyncio.sleep(60)  # Check every 60 seconds
 
-    async def heartbeat_loop(self, run_id: str, stop_event: asyncio.Event):
+    async def heartbeat_loop(self, run_id: str, stop_event: asyncio.Event, run_task: asyncio.Task):
         """
-        Periodically updates 'lastHeartbeat' for the given run until 'stop_event' is set.
+        Periodically renews this worker's lease on the given run until 'stop_event' is set. If the lease was lost,
+        'run_task' is cancelled and True is returned.
         """
         try:
             while not stop_event.is_set():
-                update_run_heartbeat(run_id)
-                await asyncio.sleep(10)  # Heartbeat interval in seconds
+                try:
+                    if not await update_run_heartbeat(run_id, self.worker_id):
+                        run_task.cancel()
+                        return True
+                except Exception as exc:
+                    logging.error(f"Failed to renew the lease on run {run_id}: {exc}")
+                try:
+                    # Heartbeat interval in seconds; returns early once the heartbeat is stopped
+                    await asyncio.wait_for(stop_event.wait(), timeout=10)
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             pass
+        return False
 
     def start(self):
         """
@@ -112,9 +403,18 @@ class JobService:
         except KeyboardInterrupt:
             logging.info("Service stopped by user.")
         finally:
+            loop.run_until_complete(self.stop_background_tasks())
+            if self.completer is not None:
+                loop.run_until_complete(self.completer.close())
+            loop.run_until_complete(close_http_client())
+            close_db()
             loop.close()
 
 
 if __name__ == "__main__":
+    if REPLAY:
+        # Load testing: scripted stand-ins replace the model and the Rowboat API (see replay.py)
+        install_replay()
+        logging.warning("Replay mode: simulations use scripted stand-ins for the model and the Rowboat API.")
     service = JobService()
     service.start()
@@ -1,45 +1,74 @@
 import asyncio
 import logging
-from typing import List
+from typing import Optional
 import json
 import os
-from openai import OpenAI
+import re
+from openai import AsyncOpenAI
 
-from scenario_types import TestSimulation, TestResult, AggregateResults, TestScenario
+from scenario_types import TestSimulation, TestResult, TestScenario
 
-from db import write_test_result, get_scenario_by_id
-from rowboat import Client, StatefulChat
+from rowboat_client import AsyncClient, AsyncStatefulChat
 
-openai_client = OpenAI()
+openai_client = AsyncOpenAI()
 MODEL_NAME = "gpt-4o"
 ROWBOAT_API_HOST = os.environ.get("ROWBOAT_API_HOST", "http://127.0.0.1:3000").strip()
+# Maximum number of calls in flight across all runs of this process, to the model playing the user and evaluating
+# conversations, and to the bot under test
+SIMULATOR_CONCURRENCY = int(os.environ.get("SIMULATOR_CONCURRENCY", "50"))
+BOT_CONCURRENCY = int(os.environ.get("BOT_CONCURRENCY", "50"))
+
+simulator_semaphore = asyncio.Semaphore(SIMULATOR_CONCURRENCY)
+bot_semaphore = asyncio.Semaphore(BOT_CONCURRENCY)
+
+# Conversations end before max_iterations once the simulated customer emits END_CONVERSATION_TOKEN or the bot says
+# goodbye
+EARLY_TERMINATION = os.environ.get("EARLY_TERMINATION", "true").lower() == "true"
+END_CONVERSATION_TOKEN = "<END_CONVERSATION>"
+FAREWELL_PATTERN = re.compile(
+    r"\b(good\s?bye|bye|have a (great|good|nice|wonderful) (day|evening|weekend|one))\b(\W+\w+)?\W*$",
+    re.IGNORECASE,
+)
+
+
+def is_farewell(message: str) -> bool:
+    """
+    Whether a bot reply closes the conversation, i.e. ends with a farewell.
+    """
+    return bool(FAREWELL_PATTERN.search(message.strip()))
 
 
 async def simulate_simulation(
     scenario: TestScenario,
     profile_id: str,
     pass_criteria: str,
-    rowboat_client: Client,
+    rowboat_client: AsyncClient,
     workflow_id: str,
     max_iterations: int = 5,
-) -> tuple[str, str, str]:
+) -> tuple[str, str, str, int]:
     """
     Runs a mock simulation for a given TestSimulation asynchronously.
-    After simulating several turns of conversation, it evaluates the conversation.
-    Returns a tuple of (evaluation_result, details, transcript_str).
+    After simulating up to max_iterations turns of conversation, it evaluates the conversation. The conversation
+    ends early when the simulated customer considers it finished or the bot says goodbye (see EARLY_TERMINATION).
+    Returns a tuple of (evaluation_result, details, transcript_str, turns).
     """
 
-    loop = asyncio.get_running_loop()
     pass_criteria = pass_criteria
 
     # Todo: add profile_id
-    support_chat = StatefulChat(rowboat_client, workflow_id=workflow_id, test_profile_id=profile_id)
+    support_chat = AsyncStatefulChat(rowboat_client, workflow_id=workflow_id, test_profile_id=profile_id)
 
     messages = [
         {
             "role": "system",
             "content": (
                 f"You are role playing a customer talking to a chatbot (the user is role playing the chatbot). Have the following chat with the chatbot. Scenario:\n{scenario.description}. You are provided no other information. If the chatbot asks you for information that is not in context, go ahead and provide one unless stated otherwise in the scenario. Directly have the chat with the chatbot. Start now with your first message."
+                + (
+                    " Once the scenario is resolved or the chatbot has ended the conversation, reply with only "
+                    f"{END_CONVERSATION_TOKEN} instead of a message."
+                    if EARLY_TERMINATION
+                    else ""
+                )
             ),
         }
     ]
@@ -47,25 +76,26 @@ async def simulate_simulation(
     # -------------------------
     # (1) MAIN SIMULATION LOOP
     # -------------------------
+    turns = 0
     for _ in range(max_iterations):
-        openai_input = messages
-
-        # Run OpenAI API call in a separate thread (non-blocking)
-        simulated_user_response = await loop.run_in_executor(
-            None,  # default ThreadPool
-            lambda: openai_client.chat.completions.create(
+        async with simulator_semaphore:
+            simulated_user_response = await openai_client.chat.completions.create(
                 model=MODEL_NAME,
-                messages=openai_input,
+                messages=messages,
                 temperature=0.0,
-            ),
-        )
+            )
 
         simulated_content = simulated_user_response.choices[0].message.content.strip()
+        if EARLY_TERMINATION and END_CONVERSATION_TOKEN in simulated_content:
+            break
         messages.append({"role": "assistant", "content": simulated_content})
-        # Run Rowboat chat in a thread if it's synchronous
-        rowboat_response = await loop.run_in_executor(None, lambda: support_chat.run(simulated_content))
+        async with bot_semaphore:
+            rowboat_response = await support_chat.run(simulated_content)
 
         messages.append({"role": "user", "content": rowboat_response})
+        turns += 1
+        if EARLY_TERMINATION and is_farewell(rowboat_response):
+            break
 
     # -------------------------
     # (2) EVALUATION STEP
@@ -106,13 +136,10 @@ async def simulate_simulation(
         },
     ]
 
-    # Run evaluation in a separate thread
-    eval_response = await loop.run_in_executor(
-        None,
-        lambda: openai_client.chat.completions.create(
+    async with simulator_semaphore:
+        eval_response = await openai_client.chat.completions.create(
             model=MODEL_NAME, messages=evaluation_prompt, temperature=0.0, response_format={"type": "json_object"}
-        ),
-    )
+        )
 
     if not eval_response.choices:
         raise Exception("No evaluation response received from model")
@@ -126,53 +153,48 @@ async def simulate_simulation(
     if evaluation_result is None:
         raise Exception("No 'verdict' field found in evaluation response")
 
-    return (evaluation_result, details, transcript)
+    return (evaluation_result, details, transcript, turns)
 
 
-async def simulate_simulations(
-    simulations: List[TestSimulation], run_id: str, workflow_id: str, api_key: str, max_iterations: int = 5
-) -> AggregateResults:
+async def run_simulation(
+    simulation: TestSimulation,
+    scenario: Optional[TestScenario],
+    run_id: str,
+    project_id: str,
+    rowboat_client: AsyncClient,
+    workflow_id: str,
+    max_iterations: int = 5,
+) -> TestResult:
     """
-    Simulates a list of TestSimulations asynchronously and aggregates the results.
+    Runs one simulation of a run and returns its result.
+    A simulation that raises is recorded as a failed result with the error, so it does not affect the others.
     """
-    if not simulations:
-        # Return an empty result if there's nothing to simulate
-        return AggregateResults(total=0, pass_=0, fail=0)
-
-    project_id = simulations[0].projectId
-
-    client = Client(host=ROWBOAT_API_HOST, project_id=project_id, api_key=api_key)
-
-    # Store results here
-    results: List[TestResult] = []
-
-    for simulation in simulations:
-        verdict, details, transcript = await simulate_simulation(
-            scenario=get_scenario_by_id(simulation.scenarioId),
+    try:
+        verdict, details, transcript, turns = await simulate_simulation(
+            scenario=scenario,
             profile_id=simulation.profileId,
             pass_criteria=simulation.passCriteria,
-            rowboat_client=client,
+            rowboat_client=rowboat_client,
             workflow_id=workflow_id,
             max_iterations=max_iterations,
         )
-
-        # Create a new TestResult
-        test_result = TestResult(
+        return TestResult(
             projectId=project_id,
             runId=run_id,
             simulationId=simulation.id,
             result=verdict,
             details=details,
             transcript=transcript,
+            turns=turns,
+            turnsSaved=max_iterations - turns,
+        )
+    except Exception as exc:
+        logging.error(f"Simulation {simulation.id} of run {run_id} failed: {exc}")
+        return TestResult(
+            projectId=project_id,
+            runId=run_id,
+            simulationId=simulation.id,
+            result="fail",
+            details=f"Simulation error: {exc}",
+            transcript=json.dumps([]),
         )
-        results.append(test_result)
-
-        # Persist the test result
-        write_test_result(test_result)
-
-    # Aggregate pass/fail
-    total_count = len(results)
-    pass_count = sum(1 for r in results if r.result == "pass")
-    fail_count = sum(1 for r in results if r.result == "fail")
-
-    return AggregateResults(total=total_count, passCount=pass_count, failCount=fail_count)
@@ -23,7 +23,8 @@ export async function getCopilotResponse(
     messages: z.infer<typeof CopilotMessage>[],
     current_workflow_config: z.infer<typeof Workflow>,
     context: z.infer<typeof CopilotChatContext> | null,
-    dataSources?: z.infer<typeof DataSource>[]
+    dataSources?: z.infer<typeof DataSource>[],
+    conversationId?: string
 ): Promise<{
     message: z.infer<typeof CopilotAssistantMessage>;
     rawRequest: unknown;
@@ -67,6 +68,8 @@ export async function getCopilotResponse(
             console.log('Processed data source:', JSON.stringify(result));
             return result;
         }) : undefined,
+        projectId,
+        conversationId,
     };
     console.log(`sending copilot request`, JSON.stringify(request));
 
@@ -129,7 +132,8 @@ export async function getCopilotResponseStream(
     messages: z.infer<typeof CopilotMessage>[],
     current_workflow_config: z.infer<typeof Workflow>,
     context: z.infer<typeof CopilotChatContext> | null,
-    dataSources?: z.infer<typeof DataSource>[]
+    dataSources?: z.infer<typeof DataSource>[],
+    conversationId?: string
 ): Promise<{
     streamId: string;
 }> {
@@ -155,6 +159,8 @@ export async function getCopilotResponseStream(
         current_workflow_config: JSON.stringify(copilotWorkflow),
         context: context ? convertToCopilotApiChatContext(context) : null,
         dataSources: dataSources ? dataSources.map(ds => CopilotDataSource.parse(ds)) : undefined,
+        projectId,
+        conversationId,
     };
 
     // serialize the request
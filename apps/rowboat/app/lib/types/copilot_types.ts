@@ -120,6 +120,8 @@ export const CopilotAPIRequest = z.object({
     current_workflow_config: z.string(),
     context: CopilotApiChatContext.nullable(),
     dataSources: z.array(CopilotDataSource).optional(),
+    projectId: z.string().optional(),
+    conversationId: z.string().optional(),
 });
 export const CopilotAPIResponse = z.union([
     z.object({
@@ -42,6 +42,8 @@ export const TestRun = z.object({
       passCount: z.number(),
       failCount: z.number(),
     }).optional(),
+    workerId: z.string().optional(),
+    attempts: z.number().optional(),
 });
 
 export const TestResult = z.object({
@@ -50,5 +52,7 @@ export const TestResult = z.object({
     simulationId: z.string(),
     result: z.union([z.literal('pass'), z.literal('fail')]),
     details: z.string(),
-    transcript: z.string()
+    transcript: z.string(),
+    turns: z.number().optional(),
+    turnsSaved: z.number().optional(),
 });
\ No newline at end of file
@@ -30,6 +30,8 @@ export function useCopilot({ projectId, workflow, context, dataSources }: UseCop
 
     const cancelRef = useRef<() => void>(() => { });
     const responseRef = useRef('');
+    // Lets the copilot service send only the workflow changes on later turns of this chat
+    const conversationIdRef = useRef(crypto.randomUUID());
 
     const start = useCallback(async (
         messages: z.infer<typeof CopilotMessage>[],
@@ -43,7 +45,14 @@ export function useCopilot({ projectId, workflow, context, dataSources }: UseCop
         setLoading(true);
 
         try {
-            const res = await getCopilotResponseStream(projectId, messages, workflow, context || null, dataSources);
+            const res = await getCopilotResponseStream(
+                projectId,
+                messages,
+                workflow,
+                context || null,
+                dataSources,
+                conversationIdRef.current
+            );
             const eventSource = new EventSource(`/api/copilot-stream-response/${res.streamId}`);
 
             eventSource.onmessage = (event) => {
@@ -108,6 +108,10 @@ async def chat():
             state=data.get("state", {}),
             complete_request=data,
             enable_tracing=ENABLE_TRACING,
+            prefetch_rag=master_config.get("prefetch_rag", False),
+            post_process=master_config.get("post_process", False),
+            prefetch_match_threshold=master_config.get("prefetch_rag_match_threshold"),
+            guardrail_fallback_message=master_config.get("guardrail_fallback_message"),
         ):
             if event_type == "message":
                 messages.append(event_data)
@@ -179,9 +183,17 @@ async def chat_stream():
                 state=request_data.get("state", {}),
                 complete_request=request_data,
                 enable_tracing=ENABLE_TRACING,
+                prefetch_rag=master_config.get("prefetch_rag", False),
+                post_process=master_config.get("post_process", False),
+                prefetch_match_threshold=master_config.get("prefetch_rag_match_threshold"),
+                guardrail_fallback_message=master_config.get("guardrail_fallback_message"),
             ):
                 if event_type == "message":
                     yield format_sse(event_data, "message")
+                elif event_type == "delta":
+                    yield format_sse(event_data, "delta")
+                elif event_type == "reset":
+                    yield format_sse(event_data, "reset")
                 elif event_type == "done":
                     yield format_sse(event_data, "done")
                 elif event_type == "error":
@@ -8,8 +8,17 @@ from .helpers.access import get_agent_by_name, get_external_tools, get_prompt_by
 from .helpers.library_tools import handle_web_search_event
 from .helpers.control import get_last_agent_name
 from .execute_turn import run_streamed as swarm_run_streamed, get_agents
+from .helpers.rag_prefetch import DEFAULT_MATCH_THRESHOLD, RagPrefetchCache
+from .tool_calling import DEFAULT_RAG_TOKEN_BUDGET
 from .helpers.instructions import add_child_transfer_related_instructions
-from .types import PromptType, outputVisibility, ResponseType
+from .guardrails import (
+    GuardrailStage,
+    get_recent_chat_history,
+    stream_post_process_response,
+    POST_PROCESS_HISTORY_WINDOW,
+)
+from .types import AgentRole, PromptType, outputVisibility, ResponseType, GuardrailMode
+from src.utils.client import PROVIDER_DEFAULT_MODEL
 from agents.extensions.handoff_prompt import RECOMMENDED_PROMPT_PREFIX
 
 
@@ -93,6 +102,33 @@ def append_messages(messages, accumulated_messages):
     return messages
 
 
+MAX_RAG_PREFETCHES_PER_TURN = 2
+
+
+def start_rag_prefetches(rag_prefetch, messages, agent_configs, last_agent_name, complete_request):
+    """
+    Starts speculative retrievals for the latest user message, one per distinct RAG configuration,
+    beginning with the agent that starts the turn.
+    """
+    latest_user_message = next((msg for msg in reversed(messages) if msg.get("role") == "user"), None)
+    if not latest_user_message or not latest_user_message.get("content"):
+        return
+
+    rag_agent_configs = sorted(
+        (ac for ac in agent_configs if ac.get("hasRagSources", False) and ac.get("ragDataSources")),
+        key=lambda ac: ac.get("name") != last_agent_name,
+    )
+    for agent_config in rag_agent_configs[:MAX_RAG_PREFETCHES_PER_TURN]:
+        rag_prefetch.start(
+            complete_request.get("projectId", ""),
+            latest_user_message["content"],
+            agent_config.get("ragDataSources", []),
+            agent_config.get("ragReturnType", "chunks"),
+            agent_config.get("ragK", 3),
+            agent_config.get("ragTokenBudget", DEFAULT_RAG_TOKEN_BUDGET),
+        )
+
+
 async def run_turn_streamed(
     messages,
     start_agent_name,
@@ -103,6 +139,10 @@ async def run_turn_streamed(
     state={},
     complete_request={},
     enable_tracing=None,
+    prefetch_rag=False,
+    post_process=False,
+    prefetch_match_threshold=None,
+    guardrail_fallback_message=None,
 ):
     """
     Run a turn of the conversation with streaming responses.
@@ -113,6 +153,20 @@ async def run_turn_streamed(
     3. Each agent can output at most one regular message per parent
     4. Control flows from parent to child, and child must return to parent after responding
     5. Turn ends when an external agent outputs a message
+
+    With prefetch_rag, a retrieval for the latest user message is started alongside the first model call
+    for agents with RAG sources, and matching rag_search calls reuse it (see RagPrefetchCache for
+    prefetch_match_threshold). Hit counts are reported in the final state under "rag_prefetch".
+
+    Agents with a guardrail mode get a hallucination check of their user-facing response, as sent after
+    any post processing, against the tool outputs of the turn: in "audit" mode it runs in the background
+    without delaying the response, in "blocking" mode the response (and its rewrite deltas) waits for the
+    verdict and is replaced by the agent's fallback message, or guardrail_fallback_message, if it is not
+    supported. Verdicts are reported under "guardrails".
+
+    With post_process, and if the workflow has a post processing agent, user-facing responses are
+    rewritten by it and the rewrite is streamed as ("delta", ...) events before the final ("message", ...)
+    event. A ("reset", ...) event means the rewrite failed and the deltas streamed so far are void.
     """
     print("\n=== Starting new turn ===")
     print(f"Starting agent: {start_agent_name}")
@@ -129,6 +183,19 @@ async def run_turn_streamed(
     child_call_counts = {}  # Track parent->child calls
     current_agent = None
     parent_stack = []
+    if prefetch_match_threshold is None:
+        prefetch_match_threshold = DEFAULT_MATCH_THRESHOLD
+    rag_prefetch = RagPrefetchCache(prefetch_match_threshold) if prefetch_rag else None
+    guardrails = GuardrailStage(guardrail_fallback_message)
+    turn_tool_outputs = []  # Grounding context for guardrail checks
+    post_process_config = post_process and next(
+        (
+            ac
+            for ac in agent_configs
+            if ac.get("type") == AgentRole.POST_PROCESSING.value and not ac.get("disabled", False)
+        ),
+        None,
+    )
 
     try:
         # Handle greeting turn
@@ -162,7 +229,10 @@ async def run_turn_streamed(
         # Initialize agents and get external tools
 
         new_agents = get_agents(
-            agent_configs=agent_configs, tool_configs=tool_configs, complete_request=complete_request
+            agent_configs=agent_configs,
+            tool_configs=tool_configs,
+            complete_request=complete_request,
+            rag_prefetch=rag_prefetch,
         )
         new_agents = add_child_transfer_related_instructions_to_agents(new_agents)
         new_agents = add_openai_recommended_instructions_to_agents(new_agents)
@@ -175,6 +245,8 @@ async def run_turn_streamed(
             start_turn_with_start_agent=start_turn_with_start_agent,
         )
         current_agent = get_agent_by_name(last_agent_name, new_agents)
+        if rag_prefetch:
+            start_rag_prefetches(rag_prefetch, messages, agent_configs, last_agent_name, complete_request)
         external_tools = get_external_tools(tool_configs)
         tokens_used = {"total": 0, "prompt": 0, "completion": 0}
         iter = 0
@@ -369,6 +441,7 @@ async def run_turn_streamed(
                             if not tool_call_id and hasattr(event.item, "tool_call_id"):
                                 tool_call_id = event.item.tool_call_id
 
+                            turn_tool_outputs.append(str(event.item.output))
                             message = {
                                 "content": str(event.item.output),
                                 "role": "tool",
@@ -425,6 +498,63 @@ async def run_turn_streamed(
                             if url_citations:
                                 message["citations"] = url_citations
 
+                            guardrail_mode = getattr(current_agent, "guardrail_mode", GuardrailMode.OFF.value)
+                            check_guardrail = (
+                                not is_internal and guardrail_mode != GuardrailMode.OFF.value and turn_tool_outputs
+                            )
+                            blocking = check_guardrail and guardrail_mode == GuardrailMode.BLOCKING.value
+
+                            # Stream the post processing rewrite; with a blocking check its deltas are held back
+                            # until the verdict on the rewrite is known and dropped if the response is blocked
+                            held_deltas = []
+                            deltas_sent = False
+                            if (
+                                not is_internal
+                                and post_process_config
+                                and current_agent.name != post_process_config["name"]
+                            ):
+                                async for pp_event_type, pp_event_data in stream_post_process_response(
+                                    message=message,
+                                    chat_history=get_recent_chat_history(messages, POST_PROCESS_HISTORY_WINDOW),
+                                    post_processing_agent_name=post_process_config["name"],
+                                    post_process_instructions=post_process_config.get("instructions", ""),
+                                    agent_instructions=current_agent.instructions,
+                                    style_prompt=get_prompt_by_type(prompt_configs, PromptType.STYLE.value),
+                                    context="\n\n".join(turn_tool_outputs) or None,
+                                    model=post_process_config.get("model") or PROVIDER_DEFAULT_MODEL,
+                                    tokens_used=tokens_used,
+                                ):
+                                    if pp_event_type == "message":
+                                        message = pp_event_data
+                                        continue
+                                    if pp_event_type == "reset":
+                                        held_deltas = []
+                                        if deltas_sent:
+                                            yield ("reset", pp_event_data)
+                                        continue
+                                    if blocking:
+                                        held_deltas.append(pp_event_data)
+                                        continue
+                                    yield ("delta", pp_event_data)
+                                    deltas_sent = True
+
+                            # Check the response the user receives, i.e. the rewrite if it was post processed,
+                            # against the tool outputs of this turn
+                            if check_guardrail:
+                                guardrail_context = "\n\n".join(turn_tool_outputs)
+                                chat_history = get_recent_chat_history(messages)
+                                if blocking:
+                                    guardrail_result = await guardrails.check_blocking(
+                                        current_agent, guardrail_context, {**message}, chat_history
+                                    )
+                                    message = guardrails.apply_verdict(current_agent, message, guardrail_result)
+                                    if guardrail_result.get("blocked"):
+                                        held_deltas = []
+                                else:
+                                    guardrails.audit(current_agent, guardrail_context, {**message}, chat_history)
+                            for delta in held_deltas:
+                                yield ("delta", delta)
+
                             # Track that this agent has responded
                             if not message.get("tool_calls"):  # If there are no tool calls, it's a content response
                                 agent_message_counts[current_agent.name] = 1
@@ -504,6 +634,10 @@ async def run_turn_streamed(
             "tokens": tokens_used,
             "turn_messages": accumulated_messages,
         }
+        if rag_prefetch:
+            final_state["rag_prefetch"] = rag_prefetch.stats()
+        if guardrails.results or guardrails.pending:
+            final_state["guardrails"] = guardrails.summary()
         print("-" * 100)
         print(f"Yielding done: {final_state}")
         print("-" * 100)
@@ -513,3 +647,7 @@ async def run_turn_streamed(
         print(traceback.format_exc())
         print(f"Error in stream processing: {str(e)}")
         yield ("error", {"error": str(e), "state": final_state})
+
+    finally:
+        if rag_prefetch:
+            rag_prefetch.close()
@@ -9,9 +9,10 @@ import pprint
 # Import helper functions needed for get_agents
 from .helpers.access import get_tool_config_by_name, get_tool_config_by_type
 from .helpers.instructions import add_rag_instructions_to_agent
-from .types import outputVisibility
+from .types import outputVisibility, GuardrailMode
 from agents import Agent as NewAgent, Runner, FunctionTool, RunContextWrapper, ModelSettings, WebSearchTool
 from .tracing import AgentTurnTraceProcessor
+from .helpers.rag_prefetch import RagPrefetchCache
 
 # Add import for OpenAI functionality
 from src.utils.common import generate_openai_output
@@ -22,7 +23,7 @@ from mcp.client.sse import sse_client
 
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-from .tool_calling import call_rag_tool
+from .tool_calling import call_rag_tool, call_rag_tool_batch, DEFAULT_RAG_TOKEN_BUDGET
 from pymongo import MongoClient
 import os
 
@@ -253,14 +254,16 @@ async def catch_all(
         return f"Error: {str(e)}"
 
 
-def get_rag_tool(config: dict, complete_request: dict) -> FunctionTool:
+def get_rag_tool(config: dict, complete_request: dict, rag_prefetch: RagPrefetchCache = None) -> FunctionTool:
     """
     Creates a RAG tool based on the provided configuration.
+    If a prefetch cache is given, calls that match a speculative retrieval started for this turn reuse its result.
     """
     project_id = complete_request.get("projectId", "")
+    rag_search = rag_prefetch.get_or_call if rag_prefetch else call_rag_tool
     if config.get("ragDataSources", None):
         print(
-            f"Creating rag_search tool with params:\n-Data Sources: {config.get('ragDataSources', [])}\n-Return Type: {config.get('ragReturnType', 'chunks')}\n-K: {config.get('ragK', 3)}"
+            f"Creating rag_search tool with params:\n-Data Sources: {config.get('ragDataSources', [])}\n-Return Type: {config.get('ragReturnType', 'chunks')}\n-K: {config.get('ragK', 3)}\n-Token Budget: {config.get('ragTokenBudget', DEFAULT_RAG_TOKEN_BUDGET)}"
         )
         params = {
             "type": "object",
@@ -272,12 +275,49 @@ def get_rag_tool(config: dict, complete_request: dict) -> FunctionTool:
             name="rag_search",
             description="Get information about an article",
             params_json_schema=params,
-            on_invoke_tool=lambda ctx, args: call_rag_tool(
+            on_invoke_tool=lambda ctx, args: rag_search(
                 project_id,
                 json.loads(args)["query"],
                 config.get("ragDataSources", []),
                 config.get("ragReturnType", "chunks"),
                 config.get("ragK", 3),
+                config.get("ragTokenBudget", DEFAULT_RAG_TOKEN_BUDGET),
+            ),
+        )
+        return tool
+    else:
+        return None
+
+
+def get_rag_batch_tool(config: dict, complete_request: dict) -> FunctionTool:
+    """
+    Creates a batched RAG tool that answers several queries in one call, based on the provided configuration.
+    """
+    project_id = complete_request.get("projectId", "")
+    if config.get("ragDataSources", None):
+        params = {
+            "type": "object",
+            "properties": {
+                "queries": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "The queries to search for, one per fact you need",
+                }
+            },
+            "additionalProperties": False,
+            "required": ["queries"],
+        }
+        tool = FunctionTool(
+            name="rag_search_batch",
+            description="Get information about several articles at once. Use instead of calling rag_search repeatedly when you need more than one fact",
+            params_json_schema=params,
+            on_invoke_tool=lambda ctx, args: call_rag_tool_batch(
+                project_id,
+                json.loads(args)["queries"],
+                config.get("ragDataSources", []),
+                config.get("ragReturnType", "chunks"),
+                config.get("ragK", 3),
+                config.get("ragTokenBudget", DEFAULT_RAG_TOKEN_BUDGET),
             ),
         )
         return tool
@@ -288,7 +328,7 @@ def get_rag_tool(config: dict, complete_request: dict) -> FunctionTool:
 DEFAULT_MAX_CALLS_PER_PARENT_AGENT = 3
 
 
-def get_agents(agent_configs, tool_configs, complete_request):
+def get_agents(agent_configs, tool_configs, complete_request, rag_prefetch=None):
     """
     Creates and initializes Agent objects based on their configurations and connections.
     """
@@ -353,7 +393,7 @@ def get_agents(agent_configs, tool_configs, complete_request):
                 if tool_name == "web_search":
                     tool = TavilySearchTool()
                 elif tool_name == "rag_search":
-                    tool = get_rag_tool(agent_config, complete_request)
+                    tool = get_rag_tool(agent_config, complete_request, rag_prefetch)
                 else:
                     tool = FunctionTool(
                         name=tool_name,
@@ -367,6 +407,12 @@ def get_agents(agent_configs, tool_configs, complete_request):
                 if tool:
                     new_tools.append(tool)
                     print(f"Added tool {tool_name} to agent {agent_config['name']}")
+
+                if tool_name == "rag_search":
+                    batch_tool = get_rag_batch_tool(agent_config, complete_request)
+                    if batch_tool:
+                        new_tools.append(batch_tool)
+                        print(f"Added tool {batch_tool.name} to agent {agent_config['name']}")
             else:
                 print(f"WARNING: Tool {tool_name} not found in tool_configs")
 
@@ -413,6 +459,13 @@ def get_agents(agent_configs, tool_configs, complete_request):
             else:
                 print(f"Output visibility for agent {new_agent.name}: {new_agent.output_visibility}")
 
+            # Set the guardrail policy; guardrails are off unless configured
+            new_agent.guardrail_mode = agent_config.get("guardrailMode", GuardrailMode.OFF.value)
+            new_agent.guardrail_model = agent_config.get("guardrailModel", None)
+            new_agent.guardrail_fallback_message = agent_config.get("guardrailFallbackMessage", None)
+            if new_agent.guardrail_mode != GuardrailMode.OFF.value:
+                print(f"Guardrail mode for agent {new_agent.name}: {new_agent.guardrail_mode}")
+
             # Handle the connected agents
             new_agent_to_children[agent_config["name"]] = agent_config.get("connectedAgents", [])
             new_agent_name_to_index[agent_config["name"]] = len(new_agents)
@@ -1,18 +1,63 @@
 # Guardrails
-from src.utils.common import generate_llm_output
-import os
-import copy
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Any
 
-from .execute_turn import Agent, Response, create_response
+from .types import GuardrailMode
 
-from src.utils.common import common_logger, generate_openai_output, update_tokens_used
+from src.utils.client import PROVIDER_DEFAULT_MODEL, async_completions_client
+from src.utils.common import common_logger, generate_openai_output_async
 
 logger = common_logger
 
+HALLUCINATION_VERDICTS = ["yes-absolute", "yes-common-sensical", "no-absolute", "no-subtle"]
+# Used when neither the agent nor the master config ("guardrail_fallback_message") sets a fallback message
+DEFAULT_GUARDRAIL_FALLBACK_MESSAGE = "Sorry, I can't confirm this information. Could you please clarify your question?"
+GUARDRAIL_CHAT_HISTORY_WINDOW = 10
+POST_PROCESS_HISTORY_WINDOW = 6
+POST_PROCESS_MAX_INSTRUCTION_CHARS = 4000
+VERDICT_CACHE_SIZE = 1024
 
-def classify_hallucination(context: str, assistant_response: str, chat_history: list, model: str) -> str:
+# Verdicts keyed by (context hash, response hash); the context hash also covers the chat history
+verdict_cache = OrderedDict()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_verdict(output: str) -> str:
+    """
+    Extracts the verdict class from the classifier output, e.g. "verdict: no-subtle" -> "no-subtle".
+    """
+    match = re.search(r"(yes-absolute|yes-common-sensical|no-absolute|no-subtle)", (output or "").lower())
+    return match.group(1) if match else None
+
+
+def is_supported_verdict(verdict: str) -> bool:
+    # A missing verdict (classifier error or unparseable output) does not block the response
+    return verdict is None or verdict.startswith("yes")
+
+
+def get_recent_chat_history(messages: list, window: int = GUARDRAIL_CHAT_HISTORY_WINDOW) -> list:
+    """
+    Returns the most recent user and assistant messages with content, for guardrail and post processing prompts.
+    """
+    history = [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in messages
+        if msg.get("role") in ("user", "assistant") and msg.get("content")
+    ]
+    return history[-window:]
+
+
+async def classify_hallucination(context: str, assistant_response: str, chat_history: list, model: str) -> str:
     """
     Checks if an assistant's response contains hallucinations by comparing against provided context.
+    Verdicts are cached by (context hash, response hash).
 
     Args:
         context (str): The context/knowledge base to check the response against
@@ -20,7 +65,7 @@ def classify_hallucination(context: str, assistant_response: str, chat_history:
         chat_history (list): List of previous chat messages for context
 
     Returns:
-        str: Verdict indicating level of hallucination:
+        str: Verdict indicating level of hallucination, or None if the classifier gave no usable verdict:
             'yes-absolute' - completely supported by context
             'yes-common-sensical' - supported with common sense interpretation
             'no-absolute' - not supported by context
@@ -28,6 +73,11 @@ def classify_hallucination(context: str, assistant_response: str, chat_history:
     """
     chat_history_str = "\n".join([f"{message['role']}: {message['content']}" for message in chat_history])
 
+    cache_key = (hash_text(f"{model}\n{context}\n{chat_history_str}"), hash_text(assistant_response))
+    if cache_key in verdict_cache:
+        verdict_cache.move_to_end(cache_key)
+        return verdict_cache[cache_key]
+
     prompt = f"""
     You are a guardrail agent. Your job is to check if the response is hallucinating.
 
@@ -94,63 +144,93 @@ def classify_hallucination(context: str, assistant_response: str, chat_history:
             "content": prompt,
         },
     ]
-    response = generate_llm_output(messages, model)
-    return response
+    verdict = parse_verdict(await generate_openai_output_async(messages, output_type="text", model=model))
+    if verdict:
+        verdict_cache[cache_key] = verdict
+        if len(verdict_cache) > VERDICT_CACHE_SIZE:
+            verdict_cache.popitem(last=False)
+    return verdict
 
 
-def post_process_response(
-    messages: list,
-    post_processing_agent_name: str,
-    post_process_instructions: str,
-    style_prompt: str = None,
-    context: str = None,
-    model: str = "gpt-4o",
-    tokens_used: dict = {},
-    last_agent: Agent = None,
-) -> dict:
-    agent_instructions = last_agent.instructions
-    agent_history = last_agent.history
-    # agent_instructions = ''
-    # agent_history = []
-
-    pending_msg = copy.deepcopy(messages[-1])
-    logger.debug(f"Pending message keys: {pending_msg.keys()}")
+class GuardrailStage:
+    """
+    Runs hallucination checks on agent responses within a turn.
 
-    skip = False
+    In audit mode a check runs in the background while the turn continues, and its verdict is only
+    recorded. In blocking mode the response is held until its verdict is known and replaced by the
+    agent's fallback message, or `fallback_message`, if the verdict is not supported.
+    """
 
-    if pending_msg.get("tool_calls"):
-        logger.info("Last message is a tool call, skipping post processing and setting last message to external")
-        skip = True
+    def __init__(self, fallback_message: str = None):
+        self.fallback_message = fallback_message or DEFAULT_GUARDRAIL_FALLBACK_MESSAGE
+        self.results = []
+        self.pending = set()
+
+    async def run_check(self, agent: Any, mode: str, context: str, message: dict, chat_history: list) -> dict:
+        start = time.perf_counter()
+        result = {"agent": agent.name, "mode": mode, "verdict": None, "error": None}
+        try:
+            result["verdict"] = await classify_hallucination(
+                context=context,
+                assistant_response=message.get("content") or "",
+                chat_history=chat_history,
+                model=getattr(agent, "guardrail_model", None) or PROVIDER_DEFAULT_MODEL,
+            )
+        except Exception as e:
+            logger.error(f"Hallucination check failed for agent {agent.name}: {e}")
+            result["error"] = str(e)
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000)
+        logger.info(f"Guardrail verdict: {result}")
+        self.results.append(result)
+        return result
+
+    def audit(self, agent: Any, context: str, message: dict, chat_history: list):
+        """
+        Starts a check in the background; the caller does not wait for it.
+        """
+        task = asyncio.create_task(self.run_check(agent, GuardrailMode.AUDIT.value, context, message, chat_history))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
 
-    elif not pending_msg["response_type"] == "internal":
-        logger.info("Last message is not internal, skipping post processing and setting last message to external")
-        skip = True
+    async def check_blocking(self, agent: Any, context: str, message: dict, chat_history: list) -> dict:
+        """
+        Runs a check and waits for its verdict; pass the result to `apply_verdict`.
+        """
+        return await self.run_check(agent, GuardrailMode.BLOCKING.value, context, message, chat_history)
 
-    elif not pending_msg["content"]:
-        logger.info("Last message has no content, skipping post processing and setting last message to external")
-        skip = True
+    def apply_verdict(self, agent: Any, message: dict, result: dict) -> dict:
+        """
+        Replaces the message content with the fallback message if the response is not supported.
+        """
+        if not is_supported_verdict(result["verdict"]):
+            message["content"] = getattr(agent, "guardrail_fallback_message", None) or self.fallback_message
+            result["blocked"] = True
+        return message
 
-    elif not post_process_instructions:
-        logger.info("No post process instructions, skipping post processing and setting last message to external")
-        skip = True
+    def summary(self) -> dict:
+        """
+        Verdicts known so far; audit checks still running keep going in the background and are only logged.
+        """
+        return {"results": list(self.results), "pending": len(self.pending)}
 
-    if skip:
-        pending_msg["response_type"] = "external"
-        response = Response(messages=[], tokens_used=tokens_used, agent=last_agent, error_msg="")
-        return response
 
+def build_post_process_prompt(
+    content: str,
+    chat_history: list,
+    post_process_instructions: str,
+    agent_instructions: str = "",
+    style_prompt: str = None,
+    context: str = None,
+) -> str:
     agent_history_str = f"\n{'*'*100}\n".join(
-        [
-            f"Role: {message['role']} | Content: {message.get('content', 'None')} | Tool Calls: {message.get('tool_calls', 'None')}"
-            for message in agent_history[:-1]
-        ]
+        [f"Role: {message['role']} | Content: {message.get('content', 'None')}" for message in chat_history]
     )
     logger.debug(f"Agent history: {agent_history_str}")
 
     prompt = f"""
         # ROLE
 
-        You are a post processing agent responsible for rewriting a response generated by an agent, according to instructions provided below. Ensure that the response you produce adheres to the instructions provided to you (if any).
+        You are a post processing agent responsible for rewriting a response generated by an agent, according to instructions provided below. Ensure that the response you produce adheres to the instructions provided to you (if any). Output only the rewritten response.
         ------------------------------------------------------------------------
 
         # ADDITIONAL INSTRUCTIONS
@@ -191,31 +271,97 @@ def post_process_response(
     # AGENT INSTRUCTIONS
 
     Here are the instructions to the agent generating the response:
-    {agent_instructions}
+    {agent_instructions[:POST_PROCESS_MAX_INSTRUCTION_CHARS]}
 
     ------------------------------------------------------------------------
     # AGENT RESPONSE
 
     Here is the response that the agent has generated:
-    {pending_msg['content']}
+    {content}
 
     """
     prompt += agent_response_and_instructions
+    return prompt
 
-    logger.debug(f"Sanitizing response for style. Original response: {pending_msg['content']}")
-    completion = generate_openai_output(
-        messages=[{"role": "system", "content": prompt}], model=model, return_completion=True
-    )
-    content = completion.choices[0].message.content
-    if content:
-        content = content.strip().lstrip().rstrip()
-        tokens_used = update_tokens_used(provider="openai", model=model, tokens_used=tokens_used, completion=completion)
-        logger.debug(f"Response after style check: {content}, tokens used: {tokens_used}")
 
-    pending_msg["content"] = content if content else pending_msg["content"]
-    pending_msg["response_type"] = "external"
-    pending_msg["sender"] = pending_msg["sender"] + f" >> {post_processing_agent_name}"
+async def stream_post_process_response(
+    message: dict,
+    chat_history: list,
+    post_processing_agent_name: str,
+    post_process_instructions: str,
+    agent_instructions: str = "",
+    style_prompt: str = None,
+    context: str = None,
+    model: str = PROVIDER_DEFAULT_MODEL,
+    tokens_used: dict = None,
+):
+    """
+    Rewrites a user-facing message according to the post processing instructions, streaming the rewrite.
 
-    response = Response(messages=[pending_msg], tokens_used=tokens_used, agent=last_agent, error_msg="")
+    Yields ("delta", {"content": ..., "sender": ...}) events as the rewrite is generated, then
+    ("message", message) with the rewritten message. If the rewrite fails after deltas were yielded,
+    a ("reset", {"sender": ...}) event tells the client to discard them, and the original message
+    follows. Messages that need no post processing are yielded unchanged, as the same object.
 
-    return response
+    Only the last POST_PROCESS_HISTORY_WINDOW messages of `chat_history` are included in the prompt.
+    """
+    skip_reason = None
+    if message.get("tool_calls"):
+        skip_reason = "Message is a tool call"
+    elif not message.get("content"):
+        skip_reason = "Message has no content"
+    elif not post_process_instructions:
+        skip_reason = "No post process instructions"
+
+    if skip_reason:
+        logger.info(f"{skip_reason}, skipping post processing")
+        yield ("message", message)
+        return
+
+    prompt = build_post_process_prompt(
+        content=message["content"],
+        chat_history=chat_history[-POST_PROCESS_HISTORY_WINDOW:],
+        post_process_instructions=post_process_instructions,
+        agent_instructions=agent_instructions,
+        style_prompt=style_prompt,
+        context=context,
+    )
+    sender = f"{message.get('sender')} >> {post_processing_agent_name}"
+
+    logger.debug(f"Post processing response. Original response: {message['content']}")
+    content = ""
+    try:
+        stream = await async_completions_client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": prompt}],
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if chunk.usage and tokens_used is not None:
+                tokens_used["total"] += chunk.usage.total_tokens
+                tokens_used["prompt"] += chunk.usage.prompt_tokens
+                tokens_used["completion"] += chunk.usage.completion_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            delta = chunk.choices[0].delta.content
+            # Leading whitespace of the rewrite is dropped, as the full response is stripped
+            if not content:
+                delta = delta.lstrip()
+                if not delta:
+                    continue
+            content += delta
+            yield ("delta", {"content": delta, "sender": sender})
+    except Exception as e:
+        logger.error(f"Post processing failed, keeping the original response: {e}")
+        if content:
+            yield ("reset", {"sender": sender})
+        content = ""
+
+    content = content.strip()
+    if not content:
+        yield ("message", message)
+        return
+
+    logger.debug(f"Response after post processing: {content}, tokens used: {tokens_used}")
+    yield ("message", {**message, "content": content, "sender": sender})
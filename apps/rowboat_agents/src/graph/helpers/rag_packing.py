@@ -0,0 +1,108 @@
+from functools import lru_cache
+
+import numpy as np
+import tiktoken
+
+from src.utils.common import common_logger
+
+logger = common_logger
+
+DEFAULT_DEDUP_THRESHOLD = 0.95
+
+# Smallest share of a batched search's token budget a query gets, so each query returns usable content
+MIN_QUERY_TOKEN_BUDGET = 200
+
+# The copilot service has the same token helpers in apps/copilot/tokens.py; the services are deployed separately.
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The BPE file is fetched on first use; fall back to an estimate when it is unavailable
+        logger.error(f"Could not load tiktoken encoding, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[: max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def find_near_duplicates(vectors: list, threshold: float = DEFAULT_DEDUP_THRESHOLD) -> list[bool]:
+    """
+    Marks vectors whose cosine similarity to an earlier kept vector is at least `threshold`.
+
+    The vectors are expected in relevance order, so the most relevant copy of a near-duplicate is kept.
+    """
+    if len(vectors) < 2:
+        return [False] * len(vectors)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+    similarity = matrix @ matrix.T
+
+    duplicate = np.zeros(len(vectors), dtype=bool)
+    for i in range(1, len(vectors)):
+        kept = np.flatnonzero(~duplicate[:i])
+        duplicate[i] = bool(similarity[i, kept].max() >= threshold)
+    return duplicate.tolist()
+
+
+def pack_results(
+    results: list[dict],
+    token_budget: int,
+    vectors: list = None,
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+) -> list[dict]:
+    """
+    Packs RAG results, given in relevance order, into a token budget.
+
+    Results whose embedding is a near-duplicate of a more relevant result are dropped, as are
+    results with the same docId and content. The remaining results are added in relevance order
+    while they fit; if not even the most relevant result fits, its content is truncated.
+
+    Args:
+        results (list[dict]): Result dicts with a "content" key, most relevant first.
+        token_budget (int): Maximum number of content tokens to return.
+        vectors (list): Optional embeddings of the results, aligned with `results`.
+        dedup_threshold (float): Cosine similarity at or above which two results are near-duplicates.
+
+    Returns:
+        list[dict]: The packed results.
+    """
+    duplicate = find_near_duplicates(vectors, dedup_threshold) if vectors else [False] * len(results)
+
+    packed = []
+    seen = set()
+    used_tokens = 0
+    for result, is_duplicate in zip(results, duplicate):
+        key = (result.get("docId"), result.get("content"))
+        if is_duplicate or key in seen:
+            continue
+        seen.add(key)
+
+        tokens = count_tokens(result.get("content") or "")
+        if used_tokens + tokens <= token_budget:
+            packed.append(result)
+            used_tokens += tokens
+        elif not packed:
+            packed.append({**result, "content": truncate_to_tokens(result["content"], token_budget)})
+            used_tokens = token_budget
+
+    logger.info(
+        f"Packed {len(packed)} of {len(results)} RAG results into {used_tokens}/{token_budget} tokens "
+        f"({sum(duplicate)} near-duplicates dropped)"
+    )
+    return packed
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import re
+
+from src.graph.tool_calling import call_rag_tool
+from src.utils.common import common_logger
+
+logger = common_logger
+
+# Minimum share of a rag_search query's terms found in a prefetched query to reuse the prefetch. Can be overridden
+# per deployment with "prefetch_rag_match_threshold" in the master config
+DEFAULT_MATCH_THRESHOLD = float(os.environ.get("RAG_PREFETCH_MATCH_THRESHOLD", "0.5"))
+
+# Words that carry no topic, so a rewritten query is compared on its content terms only
+STOPWORDS = frozenset(
+    """
+    a an the and or but if of to in on at by for with from about into over as is are was were be been being am do
+    does did have has had can could would should will shall may might must i me my we our you your he she it its
+    they them their this that these those what which who whom whose when where why how there here any some all
+    not no yes please tell know want like just also get
+    и в во на с со по к ко о об от до за из у а но или ли же не ни что как где когда какой какая какие это этот
+    мне меня мы вы ты он она они его ее их есть быть можно пожалуйста
+    """.split()
+)
+
+# Cumulative counters across turns, for tuning the match threshold
+prefetch_totals = {"turns": 0, "prefetched": 0, "hits": 0, "misses": 0}
+
+
+def normalize_query(query: str) -> frozenset:
+    """
+    Returns the content terms of a query: lowercased words without stopwords, with a plural "s" removed.
+    """
+    terms = set()
+    for word in re.findall(r"\w+", (query or "").lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return frozenset(terms)
+
+
+def query_similarity(query: frozenset, prefetched: frozenset) -> float:
+    """
+    Share of the terms of a rag_search query that also occur in the prefetched query. The model's query is usually
+    a shorter rewrite of the user message the prefetch was made for, so terms missing from the query do not count.
+    """
+    if not query or not prefetched:
+        return 0.0
+    return len(query & prefetched) / len(query)
+
+
+class RagPrefetchCache:
+    """
+    Holds speculative RAG retrievals started at the beginning of a turn.
+
+    A rag_search call whose parameters match a prefetch and whose query is close enough to the prefetched
+    query reuses the prefetched result (awaiting it if it is still in flight) instead of running a new retrieval.
+    """
+
+    def __init__(self, match_threshold: float = DEFAULT_MATCH_THRESHOLD):
+        self.match_threshold = match_threshold
+        self.entries = []
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, project_id: str, query: str, source_ids: list, return_type: str, k: int, token_budget: int):
+        params = (project_id, tuple(source_ids), return_type, k, token_budget)
+        if any(entry["params"] == params for entry in self.entries):
+            return
+        task = asyncio.create_task(call_rag_tool(project_id, query, source_ids, return_type, k, token_budget))
+        self.entries.append({"params": params, "query": normalize_query(query), "task": task})
+        logger.info(f"Started RAG prefetch for query: {query}")
+
+    async def get_or_call(
+        self, project_id: str, query: str, source_ids: list, return_type: str, k: int, token_budget: int
+    ) -> str:
+        params = (project_id, tuple(source_ids), return_type, k, token_budget)
+        normalized = normalize_query(query)
+        for entry in self.entries:
+            if entry["params"] != params or query_similarity(normalized, entry["query"]) < self.match_threshold:
+                continue
+            try:
+                result = await entry["task"]
+            except Exception as e:
+                logger.error(f"RAG prefetch failed, running retrieval again: {e}")
+                break
+            self.hits += 1
+            logger.info(f"RAG prefetch hit for query: {query}")
+            return result
+
+        self.misses += 1
+        logger.info(f"RAG prefetch miss for query: {query}")
+        return await call_rag_tool(project_id, query, source_ids, return_type, k, token_budget)
+
+    def stats(self) -> dict:
+        calls = self.hits + self.misses
+        return {
+            "prefetched": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / calls if calls else None,
+        }
+
+    def close(self):
+        """
+        Cancels prefetches that are still running and adds this turn's counts to the cumulative totals.
+        """
+        for entry in self.entries:
+            if not entry["task"].done():
+                entry["task"].cancel()
+            elif not entry["task"].cancelled():
+                # Retrieve the exception of an unused failed prefetch so asyncio does not warn about it
+                entry["task"].exception()
+
+        prefetch_totals["turns"] += 1
+        prefetch_totals["prefetched"] += len(self.entries)
+        prefetch_totals["hits"] += self.hits
+        prefetch_totals["misses"] += self.misses
+        calls = prefetch_totals["hits"] + prefetch_totals["misses"]
+        logger.info(
+            f"RAG prefetch turn stats: {self.stats()}; cumulative: {prefetch_totals}, "
+            f"hit rate: {prefetch_totals['hits'] / calls if calls else None}"
+        )
@@ -4,6 +4,7 @@
 RAG_INSTRUCTIONS = f"""
 # Instructions about using the article retrieval tool
 - Where relevant, use the articles tool: {{rag_tool_name}} to fetch articles with knowledge relevant to the query and use its contents to respond to the user. 
+- If you need several separate facts, call rag_search_batch once with all of your queries instead of calling {{rag_tool_name}} repeatedly.
 - Do not send a separate message first asking the user to wait while you look up information. Immediately fetch the articles and respond to the user with the answer to their query. 
 - Do not make up information. If the article's contents do not have the answer, give up control of the chat (or transfer to your parent agent, as per your transfer instructions). Do not say anything to the user.
 """
@@ -1,12 +1,13 @@
 from bson.objectid import ObjectId
-from openai import OpenAI
+from openai import AsyncOpenAI
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 import asyncio
 from dataclasses import dataclass
 from typing import Dict, List, Any
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 import json
+from .helpers.rag_packing import DEFAULT_DEDUP_THRESHOLD, MIN_QUERY_TOKEN_BUDGET, pack_results
 
 # Initialize MongoDB client
 mongo_uri = os.environ.get("MONGODB_URI", "mongodb://localhost:27017")
@@ -17,12 +18,15 @@ data_source_docs_collection = db["source_docs"]
 
 
 qdrant_client = QdrantClient(url=os.environ.get("QDRANT_URL"), api_key=os.environ.get("QDRANT_API_KEY") or None)
-# Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Initialize OpenAI client; async, so embedding requests do not block the event loop
+async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 # Define embedding model
 embedding_model = "text-embedding-3-small"
 
+# Default token budget for packed RAG output; 0 disables packing. Agents can override it with `ragTokenBudget`.
+DEFAULT_RAG_TOKEN_BUDGET = int(os.environ.get("RAG_TOKEN_BUDGET", "0"))
+
 
 async def embed(model: str, value: str) -> dict:
     """
@@ -35,37 +39,29 @@ async def embed(model: str, value: str) -> dict:
     Returns:
         dict: A dictionary containing the embedding.
     """
-    response = client.embeddings.create(model=model, input=value)
+    response = await async_client.embeddings.create(model=model, input=value)
     return {"embedding": response.data[0].embedding}
 
 
-async def call_rag_tool(
-    project_id: str,
-    query: str,
-    source_ids: list[str],
-    return_type: str,
-    k: int,
-) -> dict:
+async def embed_many(model: str, values: list[str]) -> list[list[float]]:
     """
-    Runs the RAG tool call to retrieve information based on the query and source IDs.
+    Generate embeddings for several texts in a single embeddings request.
 
     Args:
-        project_id (str): The ID of the project.
-        query (str): The query string to search for.
-        source_ids (list[str]): List of source IDs to filter the search.
-        return_type (str): The type of return, e.g., 'chunks' or other.
-        k (int): The number of results to return.
+        model (str): The embedding model to use (e.g., "text-embedding-3-small").
+        values (list[str]): The texts to embed.
 
     Returns:
-        dict: A dictionary containing the results of the search.
+        list[list[float]]: One embedding per input text, in input order.
     """
+    response = await async_client.embeddings.create(model=model, input=values)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
-    print("\n\n calling rag tool \n\n")
-    print(query)
-    # Create embedding for the query
-    embed_result = await embed(model=embedding_model, value=query)
 
-    # print(embed_result)
+async def get_valid_source_ids(project_id: str, source_ids: list[str]) -> list[str]:
+    """
+    Returns the IDs of the active data sources of the project that match `source_ids` by ID or by name.
+    """
     # Fetch all active data sources for this project
     sources = await data_sources_collection.find({"projectId": project_id, "active": True}).to_list(length=None)
 
@@ -78,23 +74,30 @@ async def call_rag_tool(
             valid_source_ids.append(str(s["_id"]))
 
     print(f"Valid source ids: {valid_source_ids}")
-    # If no valid sources are found, return empty results
-    if not valid_source_ids:
-        return ""
+    return valid_source_ids
 
-    # Perform Qdrant vector search
+
+async def search_chunks(
+    project_id: str, embedding: list[float], valid_source_ids: list[str], k: int, with_vectors: bool = False
+) -> list[dict]:
+    """
+    Runs the Qdrant vector search for a single embedding and maps the points to result dicts.
+    With `with_vectors`, each result also carries the chunk embedding under "vector".
+    """
     print(f"Calling Qdrant search with limit {k}")
-    qdrant_results = qdrant_client.search(
+    qdrant_results = await asyncio.to_thread(
+        qdrant_client.search,
         collection_name="embeddings",
-        query_vector=embed_result["embedding"],
-        query_filter={
-            "must": [
-                {"key": "projectId", "match": {"value": project_id}},
-                {"key": "sourceId", "match": {"any": valid_source_ids}},
+        query_vector=embedding,
+        query_filter=models.Filter(
+            must=[
+                models.FieldCondition(key="projectId", match=models.MatchValue(value=project_id)),
+                models.FieldCondition(key="sourceId", match=models.MatchAny(any=valid_source_ids)),
             ]
-        },
+        ),
         limit=k,
         with_payload=True,
+        with_vectors=with_vectors,
     )
 
     # Map the Qdrant results to the desired format
@@ -108,16 +111,30 @@ async def call_rag_tool(
         }
         for point in qdrant_results
     ]
+    if with_vectors:
+        for result, point in zip(results, qdrant_results):
+            result["vector"] = point.vector
+    return results
 
-    print(f"Return type: {return_type}")
-    print(f"Results: {results}")
-    # If return_type is 'chunks', return the results directly
-    if return_type == "chunks":
-        chunks = json.dumps({"Information": results}, indent=2)
-        print(f"Returning chunks: {chunks}")
-        return chunks
 
-    # Otherwise, fetch the full document contents from MongoDB
+def pop_vectors(results: list[dict]) -> list:
+    """
+    Removes the "vector" key added by `search_chunks` from each result and returns the vectors in order.
+    """
+    return [r.pop("vector", None) for r in results]
+
+
+def format_rag_output(payload: dict, packed: bool) -> str:
+    # Packed output is sent compactly and without escaping non-ASCII text, which otherwise inflates token counts
+    if packed:
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(payload, indent=2)
+
+
+async def fetch_full_docs(results: list[dict]) -> list[dict]:
+    """
+    Replaces the chunk content of each result with the full document content from MongoDB.
+    """
     doc_ids = [ObjectId(r["docId"]) for r in results]
     docs = await data_source_docs_collection.find({"_id": {"$in": doc_ids}}).to_list(length=None)
 
@@ -125,14 +142,157 @@ async def call_rag_tool(
     doc_dict = {str(doc["_id"]): doc for doc in docs}
 
     # Update the results with the full document content
-    results = [{**r, "content": doc_dict.get(r["docId"], {}).get("content", "")} for r in results]
+    return [{**r, "content": doc_dict.get(r["docId"], {}).get("content", "")} for r in results]
+
+
+async def call_rag_tool(
+    project_id: str,
+    query: str,
+    source_ids: list[str],
+    return_type: str,
+    k: int,
+    token_budget: int = DEFAULT_RAG_TOKEN_BUDGET,
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+) -> dict:
+    """
+    Runs the RAG tool call to retrieve information based on the query and source IDs.
+
+    Args:
+        project_id (str): The ID of the project.
+        query (str): The query string to search for.
+        source_ids (list[str]): List of source IDs to filter the search.
+        return_type (str): The type of return, e.g., 'chunks' or other.
+        k (int): The number of results to return.
+        token_budget (int): If set, near-duplicate results are dropped and the rest packed into this many tokens.
+        dedup_threshold (float): Cosine similarity at or above which two chunks are near-duplicates.
+
+    Returns:
+        dict: A dictionary containing the results of the search.
+    """
+
+    print("\n\n calling rag tool \n\n")
+    print(query)
+    # Create embedding for the query
+    embed_result = await embed(model=embedding_model, value=query)
+
+    valid_source_ids = await get_valid_source_ids(project_id, source_ids)
+    # If no valid sources are found, return empty results
+    if not valid_source_ids:
+        return ""
+
+    # Perform Qdrant vector search
+    packed = bool(token_budget)
+    results = await search_chunks(project_id, embed_result["embedding"], valid_source_ids, k, with_vectors=packed)
+    vectors = pop_vectors(results) if packed else None
+
+    print(f"Return type: {return_type}")
+    print(f"Results: {results}")
+    # If return_type is 'chunks', return the results directly
+    if return_type == "chunks":
+        if packed:
+            results = pack_results(results, token_budget, vectors, dedup_threshold)
+        chunks = format_rag_output({"Information": results}, packed)
+        print(f"Returning chunks: {chunks}")
+        return chunks
+
+    # Otherwise, fetch the full document contents from MongoDB
+    results = await fetch_full_docs(results)
+    if packed:
+        results = pack_results(results, token_budget, vectors, dedup_threshold)
 
     # Convert results to a JSON string
-    docs = json.dumps({"Information": results}, indent=2)
+    docs = format_rag_output({"Information": results}, packed)
     print(f"Returning docs: {docs}")
     return docs
 
 
+async def call_rag_tool_batch(
+    project_id: str,
+    queries: list[str],
+    source_ids: list[str],
+    return_type: str,
+    k: int,
+    token_budget: int = DEFAULT_RAG_TOKEN_BUDGET,
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+) -> str:
+    """
+    Runs several RAG searches in one tool call.
+
+    All queries are embedded with a single embeddings request and the vector searches run concurrently.
+    A chunk (or document, for the 'docs' return type) that was already returned for an earlier query
+    is not repeated; the later query lists it under "Duplicates" instead. With a token budget, each
+    query's group is packed into an equal share of it, but no less than MIN_QUERY_TOKEN_BUDGET tokens
+    (or the whole budget, if smaller), so many queries can exceed the budget rather than come back empty.
+
+    Args:
+        project_id (str): The ID of the project.
+        queries (list[str]): The query strings to search for.
+        source_ids (list[str]): List of source IDs to filter the search.
+        return_type (str): The type of return, e.g., 'chunks' or other.
+        k (int): The number of results to return per query.
+        token_budget (int): If set, the number of content tokens to share across the queries.
+        dedup_threshold (float): Cosine similarity at or above which two chunks are near-duplicates.
+
+    Returns:
+        str: A JSON string with one group of results per query, in query order.
+    """
+    # Drop empty and repeated queries, preserving order
+    queries = list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+    print(f"\n\n calling batched rag tool with {len(queries)} queries \n\n")
+    if not queries:
+        return ""
+
+    embeddings, valid_source_ids = await asyncio.gather(
+        embed_many(model=embedding_model, values=queries),
+        get_valid_source_ids(project_id, source_ids),
+    )
+    if not valid_source_ids:
+        return ""
+
+    packed = bool(token_budget)
+    per_query_results = await asyncio.gather(
+        *(search_chunks(project_id, embedding, valid_source_ids, k, with_vectors=packed) for embedding in embeddings)
+    )
+
+    # Dedupe overlapping chunks across queries; full documents are deduped by docId
+    seen = {}
+    groups = []
+    unique_results = []
+    for query, results in zip(queries, per_query_results):
+        group = {"query": query, "Information": [], "Duplicates": []}
+        duplicate_keys = set()
+        for r in results:
+            key = r["docId"] if return_type != "chunks" else (r["docId"], r["content"])
+            if key in seen:
+                # A repeat within this query's own results is skipped; only earlier queries' results are listed
+                if seen[key] != query and key not in duplicate_keys:
+                    duplicate_keys.add(key)
+                    group["Duplicates"].append({"docId": r["docId"], "title": r["title"], "firstQuery": seen[key]})
+                continue
+            seen[key] = query
+            group["Information"].append(r)
+            unique_results.append(r)
+        if not group["Duplicates"]:
+            del group["Duplicates"]
+        groups.append(group)
+
+    if return_type != "chunks":
+        full_docs = await fetch_full_docs(unique_results)
+        content_by_doc_id = {r["docId"]: r["content"] for r in full_docs}
+        for group in groups:
+            group["Information"] = [{**r, "content": content_by_doc_id[r["docId"]]} for r in group["Information"]]
+
+    query_token_budget = max(token_budget // len(groups), min(token_budget, MIN_QUERY_TOKEN_BUDGET))
+    for group in groups:
+        vectors = pop_vectors(group["Information"])
+        if packed:
+            group["Information"] = pack_results(group["Information"], query_token_budget, vectors, dedup_threshold)
+
+    output = format_rag_output({"Results": groups}, packed)
+    print(f"Returning batched results: {output}")
+    return output
+
+
 if __name__ == "__main__":
     asyncio.run(
         call_rag_tool(
@@ -28,6 +28,12 @@ class PromptType(Enum):
     GREETING = "greeting"
 
 
+class GuardrailMode(Enum):
+    OFF = "off"
+    AUDIT = "audit"
+    BLOCKING = "blocking"
+
+
 class ErrorType(Enum):
     FATAL = "fatal"
     ESCALATE = "escalate"
@@ -7,7 +7,7 @@ import time
 from dotenv import load_dotenv
 from openai import OpenAI
 
-from src.utils.client import completions_client
+from src.utils.client import completions_client, async_completions_client
 
 load_dotenv()
 
@@ -86,6 +86,27 @@ def generate_openai_output(messages, output_type="not_json", model="gpt-4o", ret
         return None
 
 
+async def generate_openai_output_async(messages, output_type="not_json", model="gpt-4o", return_completion=False):
+    try:
+        if output_type == "json":
+            chat_completion = await async_completions_client.chat.completions.create(
+                model=model, messages=messages, response_format={"type": "json_object"}
+            )
+        else:
+            chat_completion = await async_completions_client.chat.completions.create(
+                model=model,
+                messages=messages,
+            )
+
+        if return_completion:
+            return chat_completion
+        return chat_completion.choices[0].message.content
+
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
 def generate_llm_output(messages, model):
     model_provider = None
     if "gpt" in model:
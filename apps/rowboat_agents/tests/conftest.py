@@ -0,0 +1,4 @@
+import os
+
+# The graph modules create their OpenAI clients at import time; the tests never reach the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
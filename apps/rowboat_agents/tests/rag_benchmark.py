@@ -0,0 +1,286 @@
+"""
+Benchmark for `call_rag_tool` / `call_rag_tool_batch` that runs fully offline.
+
+Qdrant runs in-memory, MongoDB is replaced by a small in-memory stand-in and embeddings come from a
+deterministic fake embedding function, so results only reflect the retrieval code path itself.
+
+Usage:
+    python -m tests.rag_benchmark --output rag_benchmark.json
+    python -m tests.rag_benchmark --corpus_sizes 1000 --k 3 10 --compare rag_benchmark.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+
+# The module creates its OpenAI client at import time; no request is ever sent with this key
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from qdrant_client import QdrantClient, models  # noqa: E402
+
+from src.graph import tool_calling  # noqa: E402
+
+PROJECT_ID = "benchmark-project"
+CHUNKS_PER_DOC = 5
+WORDS = (
+    "scooter battery range charge warranty refund order delivery account password payment card invoice "
+    "subscription plan upgrade cancel support agent ticket return exchange size color model speed brake "
+    "tire light app bluetooth firmware update error code reset"
+).split()
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    """
+    Deterministic unit vector derived from the text, standing in for a real embedding model.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class InMemoryCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+
+class InMemoryCollection:
+    """
+    Minimal async stand-in for a Motor collection, supporting the equality and `_id: {"$in": [...]}`
+    queries issued by the RAG tool.
+    """
+
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.by_id = {doc["_id"]: doc for doc in self.docs}
+        self.queries = 0
+
+    def find(self, query):
+        self.queries += 1
+        id_query = query.get("_id")
+        if isinstance(id_query, dict) and "$in" in id_query:
+            return InMemoryCursor([self.by_id[_id] for _id in id_query["$in"] if _id in self.by_id])
+        return InMemoryCursor([doc for doc in self.docs if all(doc.get(key) == value for key, value in query.items())])
+
+
+def build_corpus(corpus_size: int, num_sources: int, dim: int, chunk_words: int):
+    """
+    Creates `corpus_size` chunks spread over `num_sources` data sources and loads them into an in-memory
+    Qdrant collection and in-memory source / doc collections.
+    """
+    sources = [
+        {"_id": ObjectId(), "projectId": PROJECT_ID, "active": True, "name": f"source-{i}"} for i in range(num_sources)
+    ]
+    rng = np.random.default_rng(corpus_size)
+    docs = []
+    points = []
+    for doc_index in range((corpus_size + CHUNKS_PER_DOC - 1) // CHUNKS_PER_DOC):
+        source = sources[doc_index % num_sources]
+        doc_id = ObjectId()
+        chunks = []
+        for chunk_index in range(CHUNKS_PER_DOC):
+            if len(points) == corpus_size:
+                break
+            content = " ".join(rng.choice(WORDS, size=chunk_words))
+            chunks.append(content)
+            points.append(
+                models.PointStruct(
+                    id=len(points),
+                    vector=fake_embedding(content, dim),
+                    payload={
+                        "projectId": PROJECT_ID,
+                        "sourceId": str(source["_id"]),
+                        "docId": str(doc_id),
+                        "title": f"Document {doc_index}",
+                        "name": f"doc-{doc_index}.md",
+                        "content": content,
+                    },
+                )
+            )
+        docs.append({"_id": doc_id, "content": "\n\n".join(chunks)})
+
+    qdrant = QdrantClient(":memory:")
+    qdrant.create_collection(
+        "embeddings", vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE)
+    )
+    for start in range(0, len(points), 1000):
+        qdrant.upsert("embeddings", points[start : start + 1000])
+
+    return qdrant, InMemoryCollection(sources), InMemoryCollection(docs)
+
+
+def install_stand_ins(qdrant, sources_collection, docs_collection, dim: int):
+    async def embed(model: str, value: str) -> dict:
+        return {"embedding": fake_embedding(value, dim)}
+
+    async def embed_many(model: str, values: list[str]) -> list[list[float]]:
+        return [fake_embedding(value, dim) for value in values]
+
+    tool_calling.qdrant_client = qdrant
+    tool_calling.data_sources_collection = sources_collection
+    tool_calling.data_source_docs_collection = docs_collection
+    tool_calling.embed = embed
+    tool_calling.embed_many = embed_many
+
+
+def summarize(latencies_ms: list[float]) -> dict:
+    ordered = sorted(latencies_ms)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+
+async def run_case(source_ids, return_type, k, queries, concurrency, batch_size):
+    async def one_call(query_index):
+        if batch_size > 1:
+            batch = [queries[(query_index + i) % len(queries)] for i in range(batch_size)]
+            return await tool_calling.call_rag_tool_batch(PROJECT_ID, batch, source_ids, return_type, k)
+        return await tool_calling.call_rag_tool(PROJECT_ID, queries[query_index], source_ids, return_type, k)
+
+    # The RAG tool prints its inputs and outputs; keep that cost but not the terminal output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await one_call(0)  # warm-up
+
+        latencies_ms = []
+        output_chars = 0
+        for query_index in range(len(queries)):
+            start = time.perf_counter()
+            output = await one_call(query_index)
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+            output_chars += len(output)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(query_index):
+            async with semaphore:
+                await one_call(query_index)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(query_index) for query_index in range(len(queries))))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "latency_ms": summarize(latencies_ms),
+        "throughput_qps": len(queries) / elapsed,
+        "mean_output_chars": output_chars / len(queries),
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def case_key(result: dict) -> tuple:
+    return (result["corpus_size"], result["num_sources"], result["k"], result["return_type"], result["batch_size"])
+
+
+def print_comparison(results: list[dict], baseline_file: str):
+    with open(baseline_file, "r") as file:
+        baseline = {case_key(r): r for r in json.load(file)["results"]}
+
+    print(f"\nComparison against {baseline_file} (p50 latency / throughput, negative latency change is better):")
+    for result in results:
+        previous = baseline.get(case_key(result))
+        if not previous:
+            continue
+        latency_change = result["latency_ms"]["p50"] / previous["latency_ms"]["p50"] - 1
+        throughput_change = result["throughput_qps"] / previous["throughput_qps"] - 1
+        print(f"  {case_key(result)}: p50 {latency_change:+.1%}, throughput {throughput_change:+.1%}")
+
+
+async def main(args):
+    results = []
+    for corpus_size in args.corpus_sizes:
+        qdrant, sources_collection, docs_collection = build_corpus(
+            corpus_size, max(args.num_sources), args.dim, args.chunk_words
+        )
+        install_stand_ins(qdrant, sources_collection, docs_collection, args.dim)
+        all_source_ids = [str(source["_id"]) for source in sources_collection.docs]
+        rng = np.random.default_rng(0)
+        queries = [" ".join(rng.choice(WORDS, size=6)) for _ in range(args.queries)]
+
+        for num_sources in args.num_sources:
+            for k in args.k:
+                for return_type in args.return_types:
+                    for batch_size in args.batch_sizes:
+                        result = {
+                            "corpus_size": corpus_size,
+                            "num_sources": num_sources,
+                            "k": k,
+                            "return_type": return_type,
+                            "batch_size": batch_size,
+                            **await run_case(
+                                all_source_ids[:num_sources],
+                                return_type,
+                                k,
+                                queries,
+                                args.concurrency,
+                                batch_size,
+                            ),
+                        }
+                        results.append(result)
+                        print(
+                            f"corpus={corpus_size} sources={num_sources} k={k} return_type={return_type} "
+                            f"batch={batch_size}: p50={result['latency_ms']['p50']:.2f}ms "
+                            f"p95={result['latency_ms']['p95']:.2f}ms throughput={result['throughput_qps']:.1f}/s"
+                        )
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedding_dim": args.dim,
+            "chunk_words": args.chunk_words,
+            "queries_per_case": args.queries,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"Wrote results to {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark RAG retrieval against local stand-ins")
+    parser.add_argument("--corpus_sizes", type=int, nargs="+", default=[1000, 10000], help="Chunks in the corpus")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 10], help="Values of k to benchmark")
+    parser.add_argument("--num_sources", type=int, nargs="+", default=[1, 5], help="Data sources to search")
+    parser.add_argument(
+        "--return_types", type=str, nargs="+", default=["chunks", "docs"], help="RAG return types to benchmark"
+    )
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1], help="Queries per call; >1 uses call_rag_tool_batch"
+    )
+    parser.add_argument("--queries", type=int, default=50, help="Queries per benchmark case")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent calls in the throughput phase")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--chunk_words", type=int, default=120, help="Words per chunk")
+    parser.add_argument("--output", type=str, default=None, help="File to write the JSON results to")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results file to compare against")
+    asyncio.run(main(parser.parse_args()))
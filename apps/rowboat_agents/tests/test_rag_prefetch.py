@@ -0,0 +1,47 @@
+import asyncio
+
+from src.graph.helpers import rag_prefetch
+from src.graph.helpers.rag_prefetch import DEFAULT_MATCH_THRESHOLD, RagPrefetchCache, normalize_query, query_similarity
+
+
+def similarity(query, prefetched):
+    return query_similarity(normalize_query(query), normalize_query(prefetched))
+
+
+def test_rewritten_queries_match_the_user_message():
+    assert similarity("range of your scooter", "What is the range of your scooter?") == 1.0
+    assert (
+        similarity("scooter range single charge", "Hi! How far can your scooters go on a single charge?")
+        >= DEFAULT_MATCH_THRESHOLD
+    )
+    assert similarity("warranty period", "Is the battery covered by warranty, and for how long?") >= 0.5
+
+
+def test_unrelated_queries_do_not_match():
+    assert similarity("return policy refund", "What is the range of your scooter?") < DEFAULT_MATCH_THRESHOLD
+    assert similarity("the", "What is the range of your scooter?") == 0.0
+
+
+def test_rewritten_query_reuses_the_prefetch(monkeypatch):
+    calls = []
+
+    async def fake_call_rag_tool(project_id, query, source_ids, return_type, k, token_budget):
+        calls.append(query)
+        return f"results for {query}"
+
+    monkeypatch.setattr(rag_prefetch, "call_rag_tool", fake_call_rag_tool)
+
+    async def turn():
+        cache = RagPrefetchCache()
+        cache.start("project", "Hey, what is the range of your scooter?", ["source"], "chunks", 3, 0)
+        hit = await cache.get_or_call("project", "scooter range", ["source"], "chunks", 3, 0)
+        miss = await cache.get_or_call("project", "return policy", ["source"], "chunks", 3, 0)
+        cache.close()
+        return hit, miss, cache.stats()
+
+    hit, miss, stats = asyncio.run(turn())
+
+    assert hit == "results for Hey, what is the range of your scooter?"
+    assert miss == "results for return policy"
+    assert calls == ["Hey, what is the range of your scooter?", "return policy"]
+    assert stats["hits"] == 1 and stats["misses"] == 1